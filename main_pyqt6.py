@@ -1,18 +1,47 @@
+import asyncio
+import base64
+from collections import deque, OrderedDict
+import csv
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
 import json
+import math
 import re
-from datetime import datetime
+import secrets
+import shutil
+from datetime import datetime, timezone
+import gzip
+import hashlib
+import hmac
+import importlib.util
+import ipaddress
+import mimetypes
+import os
 from os import path
+import socket
+import socketserver
+import sqlite3
 import sys
 import threading
+from itertools import islice
+import time
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import url2pathname
+import uuid
 
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
-    QLineEdit, QDialog, QGridLayout, QMessageBox, QScrollArea
+    QLineEdit, QDialog, QGridLayout, QMessageBox, QListView, QStyledItemDelegate, QStyleOptionButton,
+    QStyleOptionViewItem, QStyle, QAbstractItemView, QFileDialog
 )
-from PyQt6.QtCore import Qt
-
-from flask import Flask, render_template_string, Response
-from queue import Queue
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QEvent, QRect, QTimer, pyqtSignal
+from PyQt6.QtGui import QColor
+
+from flask import Flask, Response, request
+from werkzeug.http import is_resource_modified
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator
+from queue import Queue, Empty, Full
 import webbrowser
 
 
@@ -29,31 +58,567 @@ HTML_TEMPLATE = """
             overflow: hidden;
             background-color: black;
         }
-        iframe {
+        iframe, video {
+            position: absolute;
+            top: 0;
+            left: 0;
             width: 100vw;
             height: 100vh;
             border: none;
         }
+        video {
+            z-index: 1;
+            background-color: black;
+        }
+        .hidden {
+            visibility: hidden;
+        }
+        #countdown {
+            position: absolute;
+            left: 0;
+            right: 0;
+            bottom: 10vh;
+            z-index: 2;
+            padding: 2vh;
+            text-align: center;
+            font: bold 5vh sans-serif;
+            color: white;
+            background-color: rgba(0, 0, 0, 0.7);
+        }
     </style>
 </head>
 <body>
-    <iframe id="video"
-        src="{{ video_url }}"
-        allowfullscreen
-        allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture; web-share"
-        referrerpolicy="strict-origin-when-cross-origin"
-        title="YouTube Video">
-    </iframe>
+    <div id="player-0"></div>
+    <div id="player-1"></div>
+    <video id="media-player" class="hidden" playsinline></video>
+    <div id="countdown" class="hidden"></div>
 
     <script>
-        const videoFrame = document.getElementById("video");
-        const evtSource = new EventSource("/video-stream");
+        // Two players are created once and reused for every song: the visible one plays the current video and the hidden one
+        // has the next video cued, so starting it only swaps the players. Every message contains the whole state of the player,
+        // so the page only has to do what is different from the state it has already applied.
+        // The page is the same for every display, the current video is the first event of the stream.
+        const players = [];
+        let readyPlayers = 0;
+        let visiblePlayer = 0;
+        let currentVideoId = null;
+        let cuedVideoId = null;
+        let appliedPlaying = true;
+        let appliedSeekCount = null;
+        let appliedLoadCount = null;
+        let pendingState = null;
+
+        function onYouTubeIframeAPIReady() {
+            const playerVars = {autoplay: 1, cc_lang_policy: 0, iv_load_policy: 3, playsinline: 1};
+            const events = {onReady: playerReady, onStateChange: playerStateChanged, onError: playerError};
+            players.push(new YT.Player("player-0", {playerVars: playerVars, events: events}));
+            players.push(new YT.Player("player-1", {playerVars: playerVars, events: events}));
+            players[1].getIframe().classList.add("hidden");
+        }
+
+        function playerReady() {
+            readyPlayers += 1;
+            if (readyPlayers === players.length && pendingState) {
+                applyState(pendingState);
+            }
+        }
+
+        // The display reports what its visible player is doing, so the manager knows when a video has ended or can't be played
+        const displayId = Math.random().toString(36).slice(2);
+        const playerStates = {"-1": "unstarted", "0": "ended", "1": "playing", "2": "paused", "3": "buffering", "5": "cued"};
+
+        // The room is taken from the address of the page (/display/<room>), the page at "/" shows the default room
+        const roomPath = location.pathname.startsWith("/display/") ? "/" + location.pathname.slice("/display/".length) : "";
+        // The key in the address of the page allows the display to report its player, so no other device can skip the songs
+        const displayKey = new URLSearchParams(location.search).get("key") || "";
+
+        function reportState(state, error) {
+            const player = mediaActive ? mediaPlayer : players[visiblePlayer];
+            const time = mediaActive ? mediaPlayer.currentTime : (player && player.getCurrentTime ? player.getCurrentTime() : 0);
+            const report = {display: displayId, state: state, video_id: currentVideoId, time: time, error: error};
+            if (transport === "websocket") {
+                if (socket && socket.readyState === WebSocket.OPEN) {
+                    socket.send(JSON.stringify(report));
+                }
+            } else {
+                fetch(`/player-state${roomPath}?key=${encodeURIComponent(displayKey)}`, {method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify(report)}).catch(function() {});
+            }
+        }
+
+        function playerStateChanged(event) {
+            if (!mediaActive && event.target === players[visiblePlayer] && playerStates[event.data]) {
+                reportState(playerStates[event.data]);
+            }
+        }
+
+        function playerError(event) {
+            if (!mediaActive && event.target === players[visiblePlayer]) {
+                reportState("error", event.data);
+            }
+        }
 
-        evtSource.onmessage = function(event) {
-            if (videoFrame.src !== event.data) {
-                videoFrame.src = event.data;
+        // While playing, the current time is reported regularly
+        setInterval(function() {
+            const player = players[visiblePlayer];
+            if (mediaActive ? !mediaPlayer.paused && !mediaPlayer.ended : players.length && readyPlayers === players.length && player.getPlayerState() === YT.PlayerState.PLAYING) {
+                reportState("playing");
             }
-        };
+        }, 5000);
+
+        // When the server has downloaded the video, it is played from the server instead of YouTube (the state then contains its URL)
+        const mediaPlayer = document.getElementById("media-player");
+        let mediaActive = false;
+        mediaPlayer.addEventListener("playing", function() { reportState("playing"); });
+        mediaPlayer.addEventListener("pause", function() { if (!mediaPlayer.ended) { reportState("paused"); } });
+        mediaPlayer.addEventListener("waiting", function() { reportState("buffering"); });
+        mediaPlayer.addEventListener("ended", function() { reportState("ended"); });
+        mediaPlayer.addEventListener("error", function() { if (mediaActive) { reportState("error", 5); } });
+
+        function applyMediaState(state) {
+            if (!mediaActive) {
+                if (readyPlayers && readyPlayers === players.length) {
+                    players[visiblePlayer].pauseVideo();  // The YouTube players may not be loaded (or not be available at all without internet)
+                }
+                mediaPlayer.classList.remove("hidden");
+                mediaActive = true;
+            }
+            if (state.video_id !== currentVideoId || state.load_count !== appliedLoadCount) {
+                mediaPlayer.src = state.media_url;
+                mediaPlayer.currentTime = state.start;
+                currentVideoId = state.video_id;
+                appliedLoadCount = state.load_count;
+                appliedPlaying = !state.playing;  // So the video is started or stopped below
+            }
+            if (appliedSeekCount === null) {
+                appliedSeekCount = state.seek_count;
+            } else if (state.seek_count !== appliedSeekCount) {
+                mediaPlayer.currentTime = state.seek_to;
+                appliedSeekCount = state.seek_count;
+            }
+            if (state.playing !== appliedPlaying) {
+                if (state.playing) {
+                    mediaPlayer.play().catch(function() {});
+                } else {
+                    mediaPlayer.pause();
+                }
+                appliedPlaying = state.playing;
+            }
+        }
+
+        function stopMedia() {
+            // Back to the YouTube players, which load the current video again
+            mediaPlayer.pause();
+            mediaPlayer.removeAttribute("src");
+            mediaPlayer.load();
+            mediaPlayer.classList.add("hidden");
+            mediaActive = false;
+            currentVideoId = null;
+        }
+
+        function applyState(state) {
+            // Downloaded videos don't need the YouTube players, so they are also played when YouTube can't be reached
+            if (state.media_url) {
+                pendingState = null;
+                applyMediaState(state);
+                return;
+            }
+            // A local file or a downloaded video is stopped also when the YouTube players aren't ready (or can't be loaded), so it doesn't play on
+            if (mediaActive) {
+                stopMedia();
+            }
+            // The first state usually arrives before the players are created, it is applied when they are ready
+            if (players.length === 0 || readyPlayers < players.length) {
+                pendingState = state;
+                return;
+            }
+
+            // The counter also starts the same video again, for example when two singers sing the same song one after the other
+            let player = players[visiblePlayer];
+            if (state.video_id !== currentVideoId || state.load_count !== appliedLoadCount) {
+                const hiddenPlayer = players[1 - visiblePlayer];
+                if (state.video_id === cuedVideoId) {
+                    // The video is already cued in the hidden player, so it only has to be shown
+                    hiddenPlayer.getIframe().classList.remove("hidden");
+                    player.getIframe().classList.add("hidden");
+                    player.stopVideo();
+                    visiblePlayer = 1 - visiblePlayer;
+                    player = hiddenPlayer;
+                    cuedVideoId = null;
+                    if (state.playing) {
+                        player.playVideo();
+                    }
+                } else if (state.playing) {
+                    player.loadVideoById({videoId: state.video_id, startSeconds: state.start});
+                } else {
+                    player.cueVideoById({videoId: state.video_id, startSeconds: state.start});
+                }
+                currentVideoId = state.video_id;
+                appliedLoadCount = state.load_count;
+                appliedPlaying = state.playing;
+            }
+
+            // The first state only tells how often was jumped before the display was opened
+            if (appliedSeekCount === null) {
+                appliedSeekCount = state.seek_count;
+            } else if (state.seek_count !== appliedSeekCount) {
+                player.seekTo(state.seek_to, true);
+                appliedSeekCount = state.seek_count;
+            }
+
+            if (state.playing !== appliedPlaying) {
+                if (state.playing) {
+                    player.playVideo();
+                } else {
+                    player.pauseVideo();
+                }
+                appliedPlaying = state.playing;
+            }
+
+            if (state.next && !state.next.media_url && state.next.video_id !== cuedVideoId && state.next.video_id !== currentVideoId) {
+                players[1 - visiblePlayer].cueVideoById({videoId: state.next.video_id, startSeconds: state.next.start});
+                cuedVideoId = state.next.video_id;
+            }
+        }
+
+        function showCountdown(countdown) {
+            const overlay = document.getElementById("countdown");
+            if (countdown.seconds > 0 && countdown.song) {
+                overlay.textContent = `${countdown.song.name} (Singer: ${countdown.song.person}) starts in ${countdown.seconds}`;
+                overlay.classList.remove("hidden");
+            } else {
+                overlay.classList.add("hidden");
+            }
+        }
+
+        // Every event has an ID, so when the connection is lost the display reconnects with the ID of the last event it has received
+        // and the server only sends the events which were missed (or the whole current state if too much was missed).
+        // The server sends a heartbeat regularly, so a connection which received nothing for a while is stalled and is opened again.
+        // The events either come from an event stream or from a WebSocket, which also carries the reports back to the server.
+        const transport = "{{ transport }}";
+        const heartbeatInterval = {{ heartbeat_ms }};
+        const handlers = {"now-playing": applyState, "countdown": showCountdown, "heartbeat": function() {}};
+        let evtSource = null;
+        let socket = null;
+        let lastEventId = null;
+        let watchdog = null;
+
+        function resetWatchdog() {
+            clearTimeout(watchdog);
+            watchdog = setTimeout(connect, heartbeatInterval * 3);
+        }
+
+        function receive(type, id, data) {
+            if (id) {
+                lastEventId = id;
+            }
+            resetWatchdog();
+            handlers[type](data);
+        }
+
+        function connect() {
+            // The hub listens on the same host as the page, but on its own port
+            const streamPort = {{ stream_port | tojson }};
+            let url = (streamPort ? `//${location.hostname}:${streamPort}` : "") + `{{ stream_path }}${roomPath}`;
+            if (lastEventId) {
+                url += `?last_event_id=${lastEventId}`;
+            }
+            if (transport === "websocket" && displayKey) {
+                url += (lastEventId ? "&" : "?") + `key=${encodeURIComponent(displayKey)}`;  // The reports are sent through the WebSocket
+            }
+
+            if (transport === "websocket") {
+                // A WebSocket doesn't reconnect by itself
+                if (socket) {
+                    socket.onclose = null;
+                    socket.close();
+                }
+                socket = new WebSocket((location.protocol === "https:" ? "wss:" : "ws:") + url);
+                socket.onmessage = function(message) {
+                    const event = JSON.parse(message.data);
+                    if (handlers[event.event]) {
+                        receive(event.event, event.id, event.data);
+                    }
+                };
+                socket.onclose = function() {
+                    clearTimeout(watchdog);
+                    setTimeout(connect, {{ retry_ms }});
+                };
+            } else {
+                if (evtSource) {
+                    evtSource.close();
+                }
+                evtSource = new EventSource(url);
+                for (const type in handlers) {
+                    evtSource.addEventListener(type, function(event) {
+                        receive(type, event.lastEventId, JSON.parse(event.data));
+                    });
+                }
+            }
+            resetWatchdog();
+        }
+
+        connect();
+    </script>
+    <script src="https://www.youtube.com/iframe_api"></script>
+</body>
+</html>
+"""
+
+# The page on which the guests request songs with their phones
+REQUEST_PAGE_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>Request a Song</title>
+    <style>
+        body {
+            margin: 0;
+            padding: 16px;
+            font: 16px sans-serif;
+            color: #222222;
+            background-color: #fafafa;
+        }
+        h1 {
+            margin: 0 0 12px;
+            font-size: 22px;
+        }
+        h2 {
+            margin: 24px 0 8px;
+            font-size: 18px;
+        }
+        label {
+            display: block;
+            margin-top: 10px;
+            font-size: 14px;
+            color: #555555;
+        }
+        input {
+            box-sizing: border-box;
+            width: 100%;
+            padding: 10px;
+            font-size: 16px;
+            border: 1px solid #cccccc;
+            border-radius: 6px;
+        }
+        button {
+            width: 100%;
+            margin-top: 16px;
+            padding: 12px;
+            font-size: 17px;
+            color: white;
+            background-color: #2a7d2a;
+            border: none;
+            border-radius: 6px;
+        }
+        button:disabled {
+            background-color: #999999;
+        }
+        #message {
+            min-height: 1.2em;
+            margin-top: 10px;
+        }
+        .error {
+            color: #cc0000;
+        }
+        .success, .current {
+            color: #2a7d2a;
+        }
+        .current {
+            font-weight: bold;
+        }
+        .mine {
+            background-color: #fff4c2;
+        }
+        li {
+            padding: 4px 0;
+        }
+    </style>
+</head>
+<body>
+    <h1>Request a Song</h1>
+    <form id="request-form">
+        <label for="person">Your name</label>
+        <input id="person" maxlength="{{ max_length }}" autocomplete="name" required>
+        <label for="name">Song</label>
+        <input id="name" maxlength="{{ max_length }}" required>
+        <label for="author">Artist</label>
+        <input id="author" maxlength="{{ max_length }}">
+        <label for="link">YouTube link</label>
+        <input id="link" type="url" maxlength="{{ max_length }}" placeholder="https://www.youtube.com/watch?v=..." required>
+        <button id="submit" type="submit">Request Song</button>
+        <div id="message"></div>
+    </form>
+    <h2>Queue</h2>
+    <div id="queue-status">Loading...</div>
+    <ol id="queue"></ol>
+
+    <script>
+        // The room is taken from the address of the page (/request/<room>), the page at "/request" is for the default room
+        const roomPath = location.pathname.startsWith("/request/") ? "/" + location.pathname.slice("/request/".length) : "";
+        const fields = ["person", "name", "author", "link"];
+        const message = document.getElementById("message");
+        const submitButton = document.getElementById("submit");
+        let lastQueue = null;
+
+        // The songs which were requested with this phone are highlighted in the queue, and the name of the singer is filled in again
+        let mySongs = [];
+        try {
+            mySongs = JSON.parse(localStorage.getItem("requested-songs") || "[]");
+        } catch (error) {
+            mySongs = [];
+        }
+        document.getElementById("person").value = localStorage.getItem("singer") || "";
+
+        function showMessage(text, className) {
+            message.textContent = text;
+            message.className = className;
+        }
+
+        // The server checks the song like the manager does and answers with an error message if it can't be added
+        document.getElementById("request-form").addEventListener("submit", function(event) {
+            event.preventDefault();
+            const song = {};
+            for (const field of fields) {
+                song[field] = document.getElementById(field).value.trim();
+            }
+            submitButton.disabled = true;
+            fetch(location.pathname, {method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify(song)})
+                .then(function(response) {
+                    return response.json().catch(function() {
+                        return {};
+                    }).then(function(result) {
+                        if (!response.ok) {
+                            throw new Error(result.error || "The song could not be sent, please try again.");
+                        }
+                        mySongs = mySongs.concat(result.id).slice(-20);
+                        localStorage.setItem("requested-songs", JSON.stringify(mySongs));
+                        localStorage.setItem("singer", song.person);
+                        for (const field of fields.slice(1)) {
+                            document.getElementById(field).value = "";
+                        }
+                        showMessage("Your song was added to the queue.", "success");
+                        if (lastQueue) {
+                            showQueue(lastQueue);
+                        }
+                    });
+                })
+                .catch(function(error) {
+                    showMessage(error.message || "The song could not be sent, please try again.", "error");
+                })
+                .finally(function() {
+                    submitButton.disabled = false;
+                });
+        });
+
+        function showQueue(queue) {
+            lastQueue = queue;
+            const items = queue.songs.map(function(song) {
+                const item = document.createElement("li");
+                item.textContent = `${song.name}${song.author ? " by " + song.author : ""} (${song.person})`;
+                if (song.id === queue.current_id) {
+                    item.className = "current";
+                } else if (mySongs.includes(song.id)) {
+                    item.className = "mine";
+                }
+                return item;
+            });
+            document.getElementById("queue").replaceChildren(...items);
+            document.getElementById("queue-status").textContent = queue.songs.length ? "" : "The queue is empty.";
+        }
+
+        // The event stream only tells that the queue has changed (the queue can be long), then the page gets the new queue.
+        // When the server has no room for another stream, the page asks for the queue regularly until the stream works again.
+        const transport = "{{ transport }}";
+        const heartbeatInterval = {{ heartbeat_ms }};
+        const handlers = {"queue-updated": queueUpdated, "heartbeat": function() {}};
+        let evtSource = null;
+        let socket = null;
+        let lastEventId = null;
+        let watchdog = null;
+        let pollTimer = null;
+
+        function pollQueue() {
+            fetch(`/song-queue${roomPath}`).then(function(response) {
+                return response.ok ? response.json() : null;
+            }).then(function(queue) {
+                if (queue && (!lastQueue || queue.version !== lastQueue.version)) {
+                    showQueue(queue);
+                }
+            }).catch(function() {});
+        }
+
+        function queueUpdated(update) {
+            if (!lastQueue || update.version !== lastQueue.version) {
+                pollQueue();
+            }
+        }
+
+        function startPolling() {
+            if (!pollTimer) {
+                pollQueue();
+                pollTimer = setInterval(pollQueue, {{ poll_ms }});
+            }
+        }
+
+        function resetWatchdog() {
+            clearTimeout(watchdog);
+            watchdog = setTimeout(connect, heartbeatInterval * 3);
+        }
+
+        function receive(type, id, data) {
+            if (id) {
+                lastEventId = id;
+            }
+            clearInterval(pollTimer);
+            pollTimer = null;
+            resetWatchdog();
+            handlers[type](data);
+        }
+
+        function connect() {
+            // The hub listens on the same host as the page, but on its own port
+            const streamPort = {{ stream_port | tojson }};
+            let url = (streamPort ? `//${location.hostname}:${streamPort}` : "") + `{{ stream_path }}${roomPath}?client=phone`;
+            if (lastEventId) {
+                url += `&last_event_id=${lastEventId}`;
+            }
+
+            if (transport === "websocket") {
+                if (socket) {
+                    socket.onclose = null;
+                    socket.close();
+                }
+                socket = new WebSocket((location.protocol === "https:" ? "wss:" : "ws:") + url);
+                socket.onmessage = function(message) {
+                    const event = JSON.parse(message.data);
+                    if (handlers[event.event]) {
+                        receive(event.event, event.id, event.data);
+                    }
+                };
+                socket.onclose = startPolling;  // The watchdog connects again later
+            } else {
+                if (evtSource) {
+                    evtSource.close();
+                }
+                evtSource = new EventSource(url);
+                for (const type in handlers) {
+                    evtSource.addEventListener(type, function(event) {
+                        receive(type, event.lastEventId, JSON.parse(event.data));
+                    });
+                }
+                evtSource.onerror = function() {
+                    // The browser only stops reconnecting when the server refused the stream
+                    if (evtSource.readyState === EventSource.CLOSED) {
+                        startPolling();
+                    }
+                };
+            }
+            resetWatchdog();
+        }
+
+        connect();
     </script>
 </body>
 </html>
@@ -61,74 +626,2528 @@ HTML_TEMPLATE = """
 
 
 SONG_FILE = "songs.json"
+STORAGE_BACKEND = "json"  # "json" rewrites the whole song file, "journal" only appends the changes to a journal file, "sqlite" also keeps a library of all songs
+SONG_JOURNAL_FILE = "songs_journal.jsonl"
+SONG_SNAPSHOT_FILE = "songs_snapshot.json"
+SONG_DATABASE_FILE = "songs.db"
+SONG_IMPORT_COLUMNS = {"person": ("person", "singer"), "name": ("name", "title", "song"), "author": ("author", "artist"), "link": ("link", "url")}  # Column names in import files
+STREAM_MODE = "thread"  # "thread" gives every display its own Flask thread, "async" serves all displays from one asyncio event loop, "websocket" does the same over WebSockets
+SERVER_BACKEND = "werkzeug"  # "werkzeug" starts a new thread per request, "pool" uses a fixed number of worker threads
+EVENT_HISTORY_SIZE = 200  # How many events are kept, so that a display which reconnects gets only the events it has missed
+STREAM_RETRY_MS = 1000  # How long a display waits before it reconnects after the connection was lost
+STREAM_HEARTBEAT_INTERVAL = 15  # Seconds between the heartbeats on an event stream without events, so proxies and browsers keep it open
+STREAM_IDLE_TIMEOUT = 600  # Seconds without any event after which an event stream is closed, the display reconnects and resumes
+STREAM_WRITE_TIMEOUT = 10  # Seconds after which a connection is closed when the display stops reading from it
+PLAYER_STATES = ("unstarted", "playing", "paused", "buffering", "ended", "cued", "error")  # The states which the displays report about their player
+PLAYER_ACTIONS = ("play", "pause", "seek", "stop")  # What the REST API can do with the players of the displays (/api/player)
+PLAYER_REPORT_INTERVAL_MS = 250  # How often the GUI checks the reports of the displays
+AUTO_ADVANCE = False  # Whether the next song is started automatically when the video has ended on a display (can be changed in the GUI)
+AUTO_ADVANCE_DELAY = 5  # Seconds between the end of a video and the start of the next song when advancing automatically
+COUNTDOWN_SECONDS = 5  # The countdown before a song starts, which is shown in the GUI and on the displays (0 starts the songs immediately)
+DEFAULT_ROOM = "main"  # The room of the main window, its displays can also use the address of the server without a room
+ROOMS = ()  # Names of further rooms, every room gets its own window, song list and displays (/display/<room>), but all are served by one server
+ROOM_NAME_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,32}')
+MEDIA_CACHE = False  # Whether the queued videos are downloaded (needs yt-dlp), so the displays play them from this computer instead of YouTube
+MEDIA_CACHE_DIRECTORY = "media_cache"
+MEDIA_CACHE_SIZE = 5 * 1024 ** 3  # Bytes, the videos which were used least recently are deleted when the cache gets bigger
+MEDIA_CACHE_WORKERS = 2  # How many videos are downloaded at the same time
+MEDIA_CACHE_FORMAT = "best[ext=mp4][height<=720]/best[ext=mp4]/best"  # yt-dlp format of the downloaded videos, a single file which browsers can play
+MEDIA_PREFETCH_COUNT = 5  # How many songs at the start of the song list are downloaded in advance
+SERVER_HOST = "127.0.0.1"  # The address of the server with a window, "0.0.0.0" makes the displays and the request page reachable from other devices
+HEADLESS_HOST = "0.0.0.0"  # The address of the server without a window (--headless), so the displays and the REST API can be reached from other computers
+API_TOKEN = None  # If set, the REST API only accepts requests with the header "Authorization: Bearer <token>" (a server on "0.0.0.0" prints a new one at every start)
+REQUEST_RATE_LIMIT = 5  # How many songs a guest (an address) can request on the request page (/request) within REQUEST_RATE_PERIOD
+REQUEST_RATE_PERIOD = 300  # Seconds
+REQUEST_MAX_LENGTH = 200  # The maximum length of the fields of a requested song
+REQUEST_POLL_INTERVAL_MS = 5000  # How often the request page asks for the queue when the server has no room for its event stream
+REQUEST_MAX_STREAMS = 50  # How many phones can get the queue over the event stream, they have their own limit so the displays can always connect
+YOUTUBE_PLAYER_ERRORS = {2: "invalid video ID", 5: "the browser can't play it", 100: "video not found or private", 101: "embedding not allowed", 150: "embedding not allowed"}
+
+
+# Response header for the event stream of the asyncio hub. It runs on its own port, so the page needs CORS to connect to it.
+SSE_RESPONSE_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Connection: keep-alive\r\n"
+    b"\r\n"
+)
+
+# The browser adds the Last-Event-ID header when it reconnects, so the hub has to allow it for requests from the page
+SSE_PREFLIGHT_RESPONSE = (
+    b"HTTP/1.1 204 No Content\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Access-Control-Allow-Methods: GET\r\n"
+    b"Access-Control-Allow-Headers: Last-Event-ID\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+)
+HEARTBEAT_EVENT = "event: heartbeat\ndata: {}\n\n"
+
+# WebSocket (RFC 6455): the GUID is fixed by the standard and is used to answer the handshake
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WEBSOCKET_CONTINUATION, WEBSOCKET_TEXT, WEBSOCKET_CLOSE, WEBSOCKET_PING, WEBSOCKET_PONG = 0x0, 0x1, 0x8, 0x9, 0xA
+WEBSOCKET_MAX_MESSAGE_SIZE = 4096
+
+
+def format_event(event):
+    # Format an event of the event log as a server-sent event
+    event_id, event_type, data = event
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+def format_events(events):
+    return "".join(format_event(event) for event in events).encode()
+
+
+PHONE_EVENT_TYPES = {"queue-updated"}  # The events which only the request pages need, the displays never get them
+
+
+def display_events(events):
+    return [event for event in events if event[1] not in PHONE_EVENT_TYPES]
+
+
+def websocket_frame(payload, opcode=1):
+    # A single unmasked frame (servers never mask their frames), the length needs more bytes for longer payloads
+    length = len(payload)
+    if length < 126:
+        head = bytes((0x80 | opcode, length))
+    elif length < 65536:
+        head = bytes((0x80 | opcode, 126)) + length.to_bytes(2, "big")
+    else:
+        head = bytes((0x80 | opcode, 127)) + length.to_bytes(8, "big")
+    return head + payload
+
+
+def unmask_websocket_payload(payload, mask):
+    # XOR the payload with the repeated mask, all at once as big integers instead of byte by byte
+    repeated_mask = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated_mask, "big")).to_bytes(len(payload), "big")
+
+
+def format_websocket_events(events):
+    # The same events as on the event stream, as one JSON message per event. The data is already JSON, so it is inserted as it is.
+    return b"".join(websocket_frame(f'{{"id": "{event_id}", "event": "{event_type}", "data": {data}}}'.encode()) for event_id, event_type, data in events)
+
+
+WEBSOCKET_HEARTBEAT = websocket_frame(b'{"id": null, "event": "heartbeat", "data": {}}')
+
+
+def websocket_handshake_response(key):
+    accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+    return (
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept}\r\n"
+        "\r\n"
+    ).encode()
+
+
+def get_last_event_id(headers, query):
+    # The browser sends the Last-Event-ID header when it reconnects by itself, the page adds it to the URL when it reconnects a stalled stream.
+    # The event log checks whether the ID is one of its own. The hub writes the names of the headers in title case, Flask ignores the case.
+    return headers.get("Last-Event-Id") or query.get("last_event_id") or None
+
+
+class EventLog:
+    def __init__(self, size=200):
+        # Numbered events for the displays. The newest events are kept, so a display which reconnects only gets the events it has missed.
+        # The newest event of every type is kept as well, so a new display (or one which has missed too much) gets the whole state at once.
+        # The IDs start with an epoch which is new every time the program starts ("<epoch>-<number>"), so the IDs of a display which kept running
+        # while the program was restarted are unknown instead of pointing to unrelated events of the new log.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.events = deque(maxlen=size)
+        self.latest_events = {}  # event type -> (number, event)
+        self.last_number = 0
+        self.lock = threading.Lock()
+
+    def add(self, event_type, data):
+        with self.lock:
+            self.last_number += 1
+            event = (f"{self.epoch}-{self.last_number}", event_type, json.dumps(data))
+            self.events.append(event)
+            self.latest_events[event_type] = (self.last_number, event)
+            return event
+
+    def _event_number(self, event_id):
+        # The number of an ID of this log, or None for IDs of other logs and invalid IDs
+        epoch, _, number = event_id.partition("-")
+        return int(number) if epoch == self.epoch and number.isdigit() else None
+
+    def get_events_after(self, last_event_id):
+        # The events which a display needs after it has received the event with the given ID (None for a new display)
+        with self.lock:
+            number = self._event_number(last_event_id) if last_event_id else None
+            if number == self.last_number:
+                return []
+            first_number = self.last_number - len(self.events) + 1
+            if number is not None and self.events and first_number - 1 <= number < self.last_number:
+                # The numbers in the log have no gaps, so the position of the first missed event can be calculated
+                return list(islice(self.events, number - first_number + 1, None))
+            # The events are too old or the ID is unknown (for example from before a restart of the program)
+            return [event for _, event in sorted(self.latest_events.values())]
+
+
+class CachedPage:
+    def __init__(self, html, mimetype="text/html"):
+        # A page which is the same for every request. It is compressed once, and the browsers only have to check with the ETag
+        # whether it has changed, so many displays loading the page at once cost almost nothing.
+        self.body = html.encode()
+        self.mimetype = mimetype
+        self.gzip_body = gzip.compress(self.body, mtime=0)
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+    def response(self, request):
+        # Both encodings are different representations of the page, so they have different ETags
+        use_gzip = request.accept_encodings["gzip"] > 0
+        etag = f"{self.etag}-gzip" if use_gzip else self.etag
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.gzip_body if use_gzip else self.body, mimetype=self.mimetype)
+            if use_gzip:
+                response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class RateLimiter:
+    def __init__(self, max_requests=5, period=300, max_clients=1000):
+        # Allows every client a number of requests within the period (counted over the last period, not in fixed intervals).
+        # Only the clients which sent a request most recently are kept, so clients with many addresses can't fill the memory.
+        self.max_requests = max_requests
+        self.period = period
+        self.max_clients = max_clients
+        self.clients = OrderedDict()  # client -> times of its requests
+        self.lock = threading.Lock()
+
+    def check(self, client):
+        # Returns 0 if the client may send a request, otherwise the seconds until it may send the next one. The request is only counted by add,
+        # so requests which fail don't count.
+        now = time.monotonic()
+        with self.lock:
+            times = self.clients.get(client)
+            while times and now - times[0] >= self.period:
+                times.popleft()
+            return self.period - (now - times[0]) if times and len(times) >= self.max_requests else 0
+
+    def add(self, client):
+        with self.lock:
+            times = self.clients.pop(client, None) or deque()
+            times.append(time.monotonic())
+            self.clients[client] = times
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+
+
+class SubscriberRegistry:
+    def __init__(self, max_subscribers=100, max_phones=REQUEST_MAX_STREAMS, queue_size=10):
+        # Holds one small queue per connected display of the thread mode, grouped by the room of the display. Disconnected displays are removed again,
+        # so the time needed to notify the displays of a room only depends on the displays which are really connected to it.
+        # The limit is for all rooms together, because every display needs its own thread of the server. The phones (the request pages)
+        # get the same events, but they have their own limit, so a full party can't take the places of the displays.
+        self.max_subscribers = max_subscribers
+        self.max_phones = max_phones
+        self.queue_size = queue_size
+        self.subscribers = {}  # room -> set of queues
+        self.phones = set()  # The queues of the phones
+        self.total = 0  # The number of displays
+        self.lock = threading.Lock()
+
+    def add(self, room, phone=False):
+        # Returns the queue of the new subscriber, or None if there are already too many subscribers of its kind
+        with self.lock:
+            if (len(self.phones) >= self.max_phones) if phone else (self.total >= self.max_subscribers):
+                return None
+            queue = Queue(maxsize=self.queue_size)
+            self.subscribers.setdefault(room, set()).add(queue)
+            if phone:
+                self.phones.add(queue)
+            else:
+                self.total += 1
+            return queue
+
+    def remove(self, queue, room):
+        with self.lock:
+            room_subscribers = self.subscribers.get(room)
+            if room_subscribers and queue in room_subscribers:
+                room_subscribers.remove(queue)
+                if queue in self.phones:
+                    self.phones.remove(queue)
+                else:
+                    self.total -= 1
+                if not room_subscribers:
+                    del self.subscribers[room]
+
+    def contains(self, queue, room):
+        with self.lock:
+            return queue in self.subscribers.get(room, ())
+
+    def close_all(self):
+        # Remove all subscribers and wake them up, so their event streams end
+        with self.lock:
+            subscribers = [queue for room_subscribers in self.subscribers.values() for queue in room_subscribers]
+            self.subscribers.clear()
+            self.phones.clear()
+            self.total = 0
+
+        for queue in subscribers:
+            try:
+                queue.put_nowait(None)
+            except Full:
+                pass  # The event stream ends anyway when it reads its next item, because it is no longer registered
+
+    def broadcast(self, item, room, phones_only=False):
+        with self.lock:
+            subscribers = [queue for queue in self.subscribers.get(room, ()) if not phones_only or queue in self.phones]
+
+        # A subscriber with a full queue has stopped reading, so it is treated as disconnected
+        for queue in subscribers:
+            try:
+                queue.put_nowait(item)
+            except Full:
+                self.remove(queue, room)
+
+    @property
+    def count(self):
+        with self.lock:
+            return self.total
+
+    @property
+    def phone_count(self):
+        with self.lock:
+            return len(self.phones)
+
+
+class AsyncBroadcastHub:
+    def __init__(self, get_event_log, host='127.0.0.1', port=5001, max_clients=100, heartbeat_interval=15, idle_timeout=600, write_timeout=10, on_report=None, report_key=None,
+                 max_phones=REQUEST_MAX_STREAMS):
+        # All clients are served by one event loop in one thread. The events are only stored once in the event log of their room,
+        # every client just remembers the ID of the last event it has sent, so memory per client is constant and publishing is O(1).
+        # The clients can either use an event stream (/video-stream/<room>) or a WebSocket (/ws/<room>), which also carries the reports of the displays
+        # back to the server. get_event_log returns the event log of a room (or None if there is no such room),
+        # and the reports are passed to on_report with the room, which is called inside the loop. If report_key is set, only the WebSockets
+        # which were opened with it (?key=...) can report. The phones (?client=phone) have their own limit, so they can't take the places of the displays.
+        self.get_event_log = get_event_log
+        self.on_report = on_report
+        self.report_key = report_key
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.changed = {}  # room -> asyncio.Event which is replaced on every publish in the room (they are created inside the loop)
+        self.max_clients = max_clients
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.write_timeout = write_timeout
+        self.stalled_clients = 0  # The number of clients which were closed because they stopped reading
+        self.max_phones = max_phones
+        self.clients = set()  # The writers of all connected clients
+        self.phones = set()  # The writers of the phones, they are also in clients
+        self.server = None
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def _start_server(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+
+    async def _handle_client(self, reader, writer):
+        # Read the request line, only the Last-Event-ID header is needed from the rest of the request header.
+        # A client which doesn't send its request in time is closed, so it can't keep a connection open forever.
+        try:
+            request_head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.write_timeout)
+            request_line, *header_lines = request_head.decode("latin-1").split("\r\n")
+            method, target = request_line.split(" ")[:2]
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError, ValueError):
+            writer.close()
+            return
+        headers = {}
+        for header_line in header_lines:
+            name, _, value = header_line.partition(":")
+            headers[name.strip().title()] = value.strip()
+        path, _, query_string = target.partition("?")
+        query = dict(parameter.partition("=")[::2] for parameter in query_string.split("&") if parameter)
+        last_event_id = get_last_event_id(headers, query)
+
+        # The paths without a room are for the default room
+        stream_path, _, room = path.partition("/")[2].partition("/")
+        room = room or DEFAULT_ROOM
+        event_log = self.get_event_log(room) if stream_path in ("video-stream", "ws") else None
+
+        try:
+            if method == "OPTIONS":
+                writer.write(SSE_PREFLIGHT_RESPONSE)
+                await writer.drain()
+                writer.close()
+                return
+
+            if method != "GET" or event_log is None:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                writer.close()
+                return
+
+            websocket_key = headers.get("Sec-Websocket-Key")
+            if stream_path == "ws" and (headers.get("Upgrade", "").lower() != "websocket" or not websocket_key):
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                writer.close()
+                return
+
+            phone = query.get("client") == "phone"
+            if (len(self.phones) >= self.max_phones) if phone else (self.client_count >= self.max_clients):
+                writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                writer.close()
+                return
+
+            if stream_path == "ws":
+                await self._send(writer, websocket_handshake_response(websocket_key))
+            else:
+                await self._send(writer, SSE_RESPONSE_HEAD + f"retry: {STREAM_RETRY_MS}\n\n".encode())
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            writer.transport.abort()
+            return
+
+        # An event stream client never sends anything after the request, so the end of the input means that it has disconnected.
+        # A WebSocket client sends the states of its player, the reading ends when it closes the connection.
+        self.clients.add(writer)
+        if phone:
+            self.phones.add(writer)
+        if stream_path == "ws":
+            can_report = not self.report_key or hmac.compare_digest(query.get("key", ""), self.report_key)
+            disconnected = asyncio.ensure_future(self._read_websocket(reader, writer, room, can_report))
+            await self._stream_events(writer, disconnected, room, event_log, last_event_id, format_websocket_events, WEBSOCKET_HEARTBEAT, phone)
+        else:
+            disconnected = asyncio.ensure_future(reader.read())
+            await self._stream_events(writer, disconnected, room, event_log, last_event_id, format_events, HEARTBEAT_EVENT.encode(), phone)
+
+    async def _stream_events(self, writer, disconnected, room, event_log, last_event_id, encode_events, heartbeat, phone=False):
+        try:
+            # Send the missed events (or the current state), then wait for the next publish. The event is taken before the log is read,
+            # so an event which is published while writing still wakes up the client.
+            # Without events a heartbeat is sent regularly, and after a long time without events the stream is closed.
+            sent_id = last_event_id
+            last_event_time = time.monotonic()
+            timed_out = False
+            while not disconnected.done():
+                changed_event = self.changed.setdefault(room, asyncio.Event())
+                events = event_log.get_events_after(sent_id)
+                if events:
+                    sent_id = events[-1][0]
+                    events = events if phone else display_events(events)
+                if events:
+                    last_event_time = time.monotonic()
+                    await self._send(writer, encode_events(events))
+                elif timed_out:
+                    if time.monotonic() - last_event_time >= self.idle_timeout:
+                        break
+                    await self._send(writer, heartbeat)
+
+                changed = asyncio.ensure_future(changed_event.wait())
+                done, _ = await asyncio.wait((changed, disconnected), timeout=self.heartbeat_interval, return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+                timed_out = not done
+        except asyncio.TimeoutError:
+            # The client stopped reading. Closing normally would wait until the data is sent, so the connection is aborted.
+            self.stalled_clients += 1
+            writer.transport.abort()
+        except (ConnectionError, OSError):
+            pass  # The client disconnected while writing
+        finally:
+            self.clients.discard(writer)
+            self.phones.discard(writer)
+            disconnected.cancel()
+            writer.close()
+
+    async def _read_websocket(self, reader, writer, room, can_report=True):
+        # Read the frames of a WebSocket client until it closes the connection. Pings are answered and the messages are reported (if the client can report).
+        message = b""
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                final, opcode, masked, length = head[0] & 0x80, head[0] & 0x0F, head[1] & 0x80, head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), "big")
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), "big")
+                if not masked or len(message) + length > WEBSOCKET_MAX_MESSAGE_SIZE:
+                    writer.write(websocket_frame((1002 if not masked else 1009).to_bytes(2, "big"), WEBSOCKET_CLOSE))
+                    return  # Clients must mask their frames, and a display never sends long messages
+                mask = await reader.readexactly(4)
+                payload = unmask_websocket_payload(await reader.readexactly(length), mask)
+
+                if opcode == WEBSOCKET_CLOSE:
+                    writer.write(websocket_frame(payload[:2], WEBSOCKET_CLOSE))
+                    return
+                if opcode == WEBSOCKET_PING:
+                    writer.write(websocket_frame(payload, WEBSOCKET_PONG))
+                elif opcode in (WEBSOCKET_TEXT, WEBSOCKET_CONTINUATION):
+                    message += payload
+                    if final:
+                        if can_report:
+                            self._report(room, message)
+                        message = b""
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass  # The client disconnected without closing the WebSocket
+
+    def _report(self, room, message):
+        try:
+            report = json.loads(message)
+        except ValueError:
+            return
+        if self.on_report and isinstance(report, dict):
+            self.on_report(room, report)
+
+    async def _send(self, writer, data):
+        # Raises asyncio.TimeoutError if the client doesn't read the data in time
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+    def _notify(self, room):
+        # Runs inside the loop: wake up the clients of the room, so they send the new events of its event log. The next client creates a new event.
+        changed = self.changed.pop(room, None)
+        if changed:
+            changed.set()
+
+    def notify(self, room):
+        # Can be called from any thread after an event was added to the event log of a room, the caller never waits for the clients
+        if self.server is not None:
+            self.loop.call_soon_threadsafe(self._notify, room)
+
+    @property
+    def client_count(self):
+        # The number of displays
+        return len(self.clients) - len(self.phones)
+
+    @property
+    def phone_count(self):
+        return len(self.phones)
+
+    def start(self):
+        # Start the loop in the background and wait until the socket is bound, so errors (like a used port) are raised here
+        self.loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_server(), self.loop).result()
+
+    async def _stop_server(self):
+        # Stop accepting clients and close all streams, which also ends their handlers
+        self.server.close()
+        for writer in list(self.clients):
+            writer.close()
+        await self.server.wait_closed()
+
+        # Give the handlers of the closed streams the time to finish, so nothing is left when the loop stops
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if pending:
+            await asyncio.wait(pending, timeout=0.5)
+
+    def stop(self, timeout=2.0):
+        # Close everything within the given time and stop the loop. The hub can't be started again afterward.
+        if not self.loop_thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop_server(), self.loop).result(timeout)
+        except TimeoutError:
+            print("[VideoServer] Not all streams of the hub could be closed in time")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout)
+
+
+class TimeoutRequestHandler(WSGIRequestHandler):
+    # Every read and write of a connection has a time limit which is set by the server. Without it a display which stops reading
+    # would block the thread of its event stream forever, because writing never finishes.
+    def setup(self):
+        self.timeout = self.server.socket_timeout
+        super().setup()
+
+
+class StoppableWSGIServer(BaseWSGIServer):
+    # Remembers the open connections, so the ones which are still open when the server stops can be closed
+    def __init__(self, host, port, app, handler=TimeoutRequestHandler, socket_timeout=5):
+        super().__init__(host, port, app, handler=handler)
+        self.socket_timeout = socket_timeout
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        super().finish_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self.connections_lock:
+            self.connections.discard(request)
+        super().shutdown_request(request)
+
+    def close_connections(self):
+        with self.connections_lock:
+            connections = list(self.connections)
+
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already closed
+
+
+class ThreadedStoppableWSGIServer(socketserver.ThreadingMixIn, StoppableWSGIServer):
+    # The same as the threaded werkzeug server: a new thread for every connection
+    multithread = True
+    daemon_threads = True
+
+
+class PooledWSGIServer(StoppableWSGIServer):
+    # Web server which handles the connections with a fixed number of worker threads.
+    # Connections which arrive while all workers are busy wait until a worker is free again.
+    multithread = True
+
+    def __init__(self, host, port, app, workers=16, socket_timeout=5):
+        super().__init__(host, port, app, socket_timeout=socket_timeout)
+        self.workers = workers
+        self.connection_queue = Queue()
+        self.busy_workers = 0
+        self.stats_lock = threading.Lock()
+
+        # The workers are daemon threads like the threads of the werkzeug server, so they never keep the script alive
+        for number in range(workers):
+            threading.Thread(target=self._worker, name=f"VideoServerWorker-{number}", daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self.connection_queue.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            request, client_address = self.connection_queue.get()
+            if request is None:
+                return
+
+            with self.stats_lock:
+                self.busy_workers += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.stats_lock:
+                    self.busy_workers -= 1
+
+    @property
+    def queued_connections(self):
+        return self.connection_queue.qsize()
+
+    def server_close(self):
+        # Close the connections which are still waiting and stop the workers once they are done with their current connection
+        super().server_close()
+        while True:
+            try:
+                request, client_address = self.connection_queue.get_nowait()
+            except Empty:
+                break
+            if request is not None:
+                self.shutdown_request(request)
+        for _ in range(self.workers):
+            self.connection_queue.put((None, None))
+
+
+def send_media_file(request, file_path, mimetype=None):
+    # Serve a file with Range requests (so the displays can seek) and conditional requests (so unchanged files aren't sent again).
+    # The server never reads the file itself, the content is copied to the socket by the kernel, so large files cost no memory.
+    try:
+        file = open(file_path, "rb")
+    except OSError:
+        return Response("File not found.", status=404)
+    stat = os.fstat(file.fileno())
+    size = stat.st_size
+    etag = f"{stat.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+    start, length, status = 0, size, 200
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        file.close()
+        length, status = 0, 304
+    elif request.range and (request.if_range.etag is None or request.if_range.etag == etag):
+        bounds = request.range.range_for_length(size)
+        if bounds is None:
+            file.close()
+            return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+        start, stop = bounds
+        length, status = stop - start, 206
+
+    if status == 304 or request.method == "HEAD":
+        file.close()
+        response = Response(status=status)
+    else:
+        response = Response(media_file_body(request.environ, file, start, length), status=status)
+    response.headers["Content-Type"] = mimetype or mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    if status != 304:
+        response.headers["Content-Length"] = str(length)
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["Cache-Control"] = "no-cache"
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def media_file_body(environ, file, start, length):
+    # The headers are sent with the first (empty) part, then socket.sendfile lets the kernel copy the file to the socket
+    # (it sends the file in parts on systems without sendfile). Without a socket, like in the test client of Flask, the file is read in parts.
+    try:
+        connection = environ.get("werkzeug.socket")
+        if connection is not None:
+            yield b""
+            connection.sendfile(file, start, length)
+        else:
+            file.seek(start)
+            while length > 0:
+                chunk = file.read(min(length, 256 * 1024))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+    finally:
+        file.close()
+
+
+class FolderFetcher:
+    def __init__(self, source_directory):
+        # Stand-in fetcher which copies "<video ID>.<extension>" from a local folder, for testing the cache without the internet
+        self.source_directory = source_directory
+
+    def __call__(self, video_id, directory):
+        for file_name in os.listdir(self.source_directory):
+            if path.splitext(file_name)[0] == video_id:
+                target_path = path.join(directory, file_name)
+                shutil.copyfile(path.join(self.source_directory, file_name), target_path)
+                return target_path
+        raise FileNotFoundError(f"No file for the video {video_id} in {self.source_directory}")
+
+
+def fetch_with_yt_dlp(video_id, directory):
+    # Download a video as a single file with sound (so no merging with ffmpeg is needed). yt-dlp is optional, it is only needed for the cache.
+    import yt_dlp
+    options = {"format": MEDIA_CACHE_FORMAT, "outtmpl": path.join(directory, "%(id)s.%(ext)s"), "quiet": True, "noprogress": True, "noplaylist": True}
+    with yt_dlp.YoutubeDL(options) as downloader:
+        info = downloader.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+        return downloader.prepare_filename(info)
+
+
+class MediaCache:
+    def __init__(self, directory, fetcher, max_bytes=5 * 1024 ** 3, workers=2, max_pending=20):
+        # Local copies of the videos, so the displays don't depend on the internet connection while a song is playing.
+        # The videos are downloaded in the background by a few workers. When the directory gets bigger than max_bytes,
+        # the videos which were used least recently are deleted (the order is kept in the OrderedDict and in the access times of the files).
+        self.directory = directory
+        self.partial_directory = path.join(directory, ".partial")
+        self.fetcher = fetcher
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.entries = OrderedDict()  # video ID -> (path, size), the least recently used first
+        self.total_bytes = 0
+        self.pending = set()  # The videos which are waiting or being downloaded
+        self.fetch_queue = Queue(maxsize=max_pending)
+        self.worker_threads = []
+        self.lock = threading.Lock()
+
+        # Find the videos which were downloaded before, files of interrupted downloads are removed
+        os.makedirs(self.partial_directory, exist_ok=True)
+        for file_name in os.listdir(self.partial_directory):
+            os.remove(path.join(self.partial_directory, file_name))
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_atime, path.splitext(entry.name)[0], entry.path, stat.st_size))
+        for _, video_id, file_path, size in sorted(files):
+            self.entries[video_id] = (file_path, size)
+            self.total_bytes += size
+        self._evict()
+
+    def start(self):
+        self.worker_threads = [threading.Thread(target=self._worker, name=f"MediaCacheWorker-{number}", daemon=True) for number in range(self.workers)]
+        for worker in self.worker_threads:
+            worker.start()
+
+    def stop(self):
+        # Forget the waiting videos and stop the workers once they have finished their current download
+        with self.lock:
+            self.pending.clear()
+        while True:
+            try:
+                self.fetch_queue.get_nowait()
+            except Empty:
+                break
+        for _ in self.worker_threads:
+            self.fetch_queue.put(None)
+        self.worker_threads = []
+
+    def get(self, video_id):
+        # The path of the video, or None if it isn't downloaded (yet). The video becomes the most recently used one.
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if entry is None:
+                return None
+            self.entries.move_to_end(video_id)
+        try:
+            os.utime(entry[0], ns=(time.time_ns(), os.stat(entry[0]).st_mtime_ns))  # So the order is the same after a restart, the modification time stays for the ETag
+        except OSError:
+            pass
+        return entry[0]
+
+    def prefetch(self, video_id):
+        # Download the video in the background if it isn't downloaded or waiting yet. If too many videos are waiting, it is skipped.
+        with self.lock:
+            if not self.worker_threads or video_id in self.entries or video_id in self.pending:
+                return
+            self.pending.add(video_id)
+        try:
+            self.fetch_queue.put_nowait(video_id)
+        except Full:
+            with self.lock:
+                self.pending.discard(video_id)
+
+    def _worker(self):
+        while True:
+            video_id = self.fetch_queue.get()
+            if video_id is None:
+                return
+            with self.lock:
+                if video_id not in self.pending:
+                    continue  # The cache was stopped in the meantime
+
+            # Download into a separate directory and move the file when it is complete, so only complete videos are ever served
+            try:
+                partial_path = self.fetcher(video_id, self.partial_directory)
+                file_path = path.join(self.directory, video_id + path.splitext(partial_path)[1])
+                os.replace(partial_path, file_path)
+                size = path.getsize(file_path)
+            except Exception as error:
+                print(f"[VideoServer] The video {video_id} could not be downloaded: {error}")
+                with self.lock:
+                    self.pending.discard(video_id)
+                continue
+
+            with self.lock:
+                self.pending.discard(video_id)
+                old_entry = self.entries.pop(video_id, None)
+                if old_entry:
+                    self.total_bytes -= old_entry[1]
+                self.entries[video_id] = (file_path, size)
+                self.total_bytes += size
+                self._evict()
+            print(f"[VideoServer] The video {video_id} was downloaded into the cache")
+
+    def _evict(self):
+        # Delete the least recently used videos until the cache is small enough again (the caller holds the lock, except in __init__)
+        while self.total_bytes > self.max_bytes and self.entries:
+            video_id, (file_path, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass  # For example still opened by a display on Windows, it is found again after a restart
+
+    @property
+    def cached_count(self):
+        with self.lock:
+            return len(self.entries)
+
+
+def create_media_cache():
+    # The media cache needs yt-dlp, without it the displays always use the YouTube player
+    if importlib.util.find_spec("yt_dlp") is None:
+        print("[VideoServer] The media cache is disabled because yt-dlp is not installed (pip install yt-dlp)")
+        return None
+    os.makedirs(MEDIA_CACHE_DIRECTORY, exist_ok=True)
+    return MediaCache(MEDIA_CACHE_DIRECTORY, fetch_with_yt_dlp, MEDIA_CACHE_SIZE, MEDIA_CACHE_WORKERS)
+
+
+class DisplayChannel:
+    def __init__(self, server, room):
+        # The displays of one room: what they show, the event log which is sent to them and what they report about their players.
+        # The rooms are independent, they only share the server (its ports, its threads and the media). Start with a video on launch.
+        self.server = server
+        self.room = room
+        self.current_video = {"command": "load", "video_id": "7WABxk9DAuw", "start": 0, "playing": True, "seek_to": None, "seek_count": 0, "load_count": 0,
+                              "next": None, "media_url": None}
+        self.current_queue = None
+
+        # The newest state which every display reported about its player, and the reports which the GUI hasn't read yet
+        self.display_states = {}
+        self.display_lock = threading.Lock()
+        self.max_displays = server.max_subscribers
+        self.player_reports = Queue(maxsize=100)
+        self.event_log = EventLog(EVENT_HISTORY_SIZE)
+        self.publish_lock = threading.Lock()  # Keeps the event log and the queues of the subscribers in the same order
+        self.event_log.add("now-playing", self.current_video)
+        self.queue_engine = None  # The song list of the room, the REST API of the server uses it
+        self.queue_page = None  # The current queue as JSON for the request pages, with the queue it was made of
+
+    def report_player_state(self, report):
+        # Called by the threads of the server (or the hub) when a display reports the state of its player. Returns False if the report is invalid.
+        try:
+            state = {
+                "display": str(report["display"])[:64],
+                "state": report["state"],
+                "video_id": str(report.get("video_id") or "")[:64] or None,
+                "time": float(report.get("time") or 0),
+                "error": int(report["error"]) if report.get("error") is not None else None,
+            }
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return False
+        if state["state"] not in PLAYER_STATES or not math.isfinite(state["time"]):
+            return False  # JSON can also contain Infinity and NaN, which the window couldn't show
+        state["time"] = max(state["time"], 0.0)
+
+        # Keep only the newest displays, so displays which send reports without end can't fill the memory
+        with self.display_lock:
+            self.display_states.pop(state["display"], None)
+            self.display_states[state["display"]] = state
+            while len(self.display_states) > self.max_displays:
+                del self.display_states[next(iter(self.display_states))]
+        try:
+            self.player_reports.put_nowait(state)
+        except Full:
+            pass  # Nobody reads the reports
+        return True
+
+    def wait_player_report(self, timeout):
+        # The next report of a display, or None if there was none within the timeout (in seconds)
+        try:
+            return self.player_reports.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def publish_event(self, event_type, data):
+        # Add an event to the event log and send it to all displays of the room
+        broadcast_hub = self.server.broadcast_hub
+        with self.publish_lock:
+            event = self.event_log.add(event_type, data)
+            if not broadcast_hub:
+                self.server.subscribers.broadcast(format_event(event), self.room, phones_only=event_type in PHONE_EVENT_TYPES)
+        if broadcast_hub:
+            broadcast_hub.notify(self.room)
+
+    def _notify_clients(self):
+        self.publish_event("now-playing", self.current_video)
+
+    def _get_next_video(self, song):
+        # The video which the displays cue in the hidden player, so it can be shown immediately when it is started
+        video = self.server.resolve_video(song)
+        return {"video_id": video[0], "start": video[1], "media_url": self.server.get_media_url(video[0])} if video else None
+
+    def _update_player(self, command, **changes):
+        # Every message contains the whole state of the player and the command which changed it last
+        self.current_video = {**self.current_video, **changes, "command": command}
+        self._notify_clients()
+
+    def set_video(self, song, next_song=None, playing=True):
+        # Check if the server is alive
+        if not self.server.server_thread.is_alive():
+            raise RuntimeError('No server is running. Please start it first with VideoServer.start()')
+
+        # Change the video of all clients by passing a song (its video is used as it is) or a valid YouTube URL or the path of a local file to this function.
+        # The song after it is optional, the displays cue it in the background. A video which isn't playing yet is started with play().
+        if song:
+            video = self.server.resolve_video(song)
+            if not video:
+                print(f"[VideoServer] Error processing URL: No video ID or media file found in {song.link if isinstance(song, Song) else song}")
+                return
+            video_id, start = video
+            self._update_player("load", video_id=video_id, start=start, playing=playing, seek_to=None, next=self._get_next_video(next_song),
+                                media_url=self.server.get_media_url(video_id), load_count=self.current_video["load_count"] + 1)
+            print(f"[VideoServer] Video changed to: {video_id} (room {self.room})")
+
+    def cue_video(self, song):
+        # Show the video on all displays, but don't start it yet
+        video = self.server.resolve_video(song)
+        if video:
+            self._update_player("cue", video_id=video[0], start=video[1], playing=False, seek_to=None, media_url=self.server.get_media_url(video[0]),
+                                load_count=self.current_video["load_count"] + 1)
+
+    def play(self):
+        self._update_player("play", playing=True)
+
+    def pause(self):
+        self._update_player("pause", playing=False)
+
+    def seek(self, seconds):
+        # The counter makes sure that every display jumps exactly once, even when jumping to the same time again
+        self._update_player("seek", seek_to=seconds, seek_count=self.current_video["seek_count"] + 1)
+
+    def set_next_video(self, next_song):
+        # Change only the video which is cued in the background, for example when the song list is reordered
+        next_video = self._get_next_video(next_song)
+        if next_video != self.current_video["next"]:
+            self._update_player("next", next=next_video)
+
+    def set_queue(self, songs, current_song_id=None):
+        # Tell the request pages that the song list has changed, but only if something has changed. The event only contains the version,
+        # so the event log doesn't keep many copies of a long queue. The pages get the queue from get_queue_page, which only keeps the newest one.
+        songs_data = [{"id": song.id, "person": song.person, "name": song.name, "author": song.author} for song in songs]
+        media_cache = self.server.media_cache
+        if media_cache:
+            # Download the next songs in the background, so they are ready when they are started
+            for song in islice(songs, MEDIA_PREFETCH_COUNT):
+                if song.video_id and not song.media_path:
+                    media_cache.prefetch(song.video_id)
+        current_queue = self.current_queue
+        if current_queue is None or songs_data != current_queue["songs"] or current_song_id != current_queue["current_id"]:
+            version = current_queue["version"] + 1 if current_queue else 1
+            self.current_queue = {"songs": songs_data, "current_id": current_song_id, "version": version}
+            self.publish_event("queue-updated", {"version": version})
+
+    def get_queue_page(self):
+        # The page is only made when it is requested, and again after the queue has changed
+        queue = self.current_queue
+        cached = self.queue_page
+        if cached is None or cached[0] is not queue:
+            cached = self.queue_page = (queue, CachedPage(json.dumps(queue or {"songs": [], "current_id": None, "version": 0}), "application/json"))
+        return cached[1]
+
+    def set_countdown(self, seconds, song=None):
+        # Show the countdown to the given song on the displays, 0 seconds hide it again
+        song_data = {"person": song.person, "name": song.name} if song else None
+        self.publish_event("countdown", {"seconds": seconds, "song": song_data})
 
 
 class VideoServer:
-    def __init__(self, host='127.0.0.1', port=5000):
-        # Define the variables and show a video on launch
+    def __init__(self, host='127.0.0.1', port=5000, stream_mode="thread", stream_port=None, max_subscribers=100, server_backend="werkzeug", workers=16,
+                 heartbeat_interval=STREAM_HEARTBEAT_INTERVAL, idle_timeout=STREAM_IDLE_TIMEOUT, write_timeout=STREAM_WRITE_TIMEOUT, media_cache=None,
+                 max_phones=REQUEST_MAX_STREAMS):
+        # Define the variables
         self.host = host
         self.port = port
+
+        # The REST API and the reports of the displays must be protected when other devices can reach the server. Without API_TOKEN a new token
+        # is created for every start. The displays get their own key (from the token), which is part of their address, because the page is public.
+        self.api_token = API_TOKEN
+        self.generated_token = False
+        if not self.api_token and not is_loopback_host(host):
+            self.api_token = secrets.token_urlsafe(16)
+            self.generated_token = True
+        self.display_key = hmac.new(self.api_token.encode(), b"display", "sha256").hexdigest()[:16] if self.api_token else None
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.write_timeout = write_timeout
         self.app = Flask(__name__)
-        self.current_video = {"url": "https://www.youtube.com/embed/7WABxk9DAuw?autoplay=1"}
-        self.subscribers = []
+        self.media_cache = media_cache  # Optional, without it the displays always use the YouTube player
+        self.local_media = {}  # video ID -> path of the local files of the songs which were played or cued
+        self.max_subscribers = max_subscribers
+        self.subscribers = SubscriberRegistry(max_subscribers, max_phones)
+
+        # Every room has its own channel, the displays of a room only get the events of its channel. The default room always exists,
+        # the methods of the server (like set_video) control it, so a single room needs no channels at all.
+        self.channels = {}
+        self.channels_lock = threading.Lock()
+        self.default_channel = self.get_channel(DEFAULT_ROOM)
+
+        # Choose how the displays are served. In the async mode the event stream is served on its own port (the next one by default)
+        if stream_mode not in ("thread", "async", "websocket"):
+            raise ValueError(f'Unknown stream mode "{stream_mode}". Use "thread", "async" or "websocket".')
+        self.stream_mode = stream_mode
+        self.broadcast_hub = None
+        if stream_mode in ("async", "websocket"):
+            self.broadcast_hub = AsyncBroadcastHub(self._get_event_log, host, stream_port or port + 1, max_subscribers, heartbeat_interval, idle_timeout,
+                                                   write_timeout, self._report_from_hub, self.display_key, max_phones)
+
+        # Choose the web server. The pool has a fixed number of workers, and the event streams of the thread mode are limited,
+        # so that there are always some workers left for loading the page. The phones get at most a quarter of the streams, the others poll the queue.
+        if server_backend not in ("werkzeug", "pool"):
+            raise ValueError(f'Unknown server backend "{server_backend}". Use "werkzeug" or "pool".')
+        self.server_backend = server_backend
+        self.workers = workers
+        if server_backend == "pool":
+            self.subscribers.max_phones = min(max_phones, max(0, workers - 2) // 4)
+            self.subscribers.max_subscribers = max(1, min(max_subscribers, workers - 2 - self.subscribers.max_phones))
+        self.http_server = None
+
+        # Count the requests which are handled right now (event streams are counted until they are closed)
+        self.active_requests = 0
+        self.request_lock = threading.Lock()
+        self.app.wsgi_app = self._count_requests(self.app.wsgi_app)
+
+        # The pages only depend on the settings (the displays and the phones take their room from the address), so the templates are compiled and rendered once
+        stream_settings = {
+            "transport": "websocket" if stream_mode == "websocket" else "sse",
+            "stream_port": self.broadcast_hub.port if self.broadcast_hub else None,
+            "stream_path": "/ws" if stream_mode == "websocket" else "/video-stream",
+            "heartbeat_ms": int(heartbeat_interval * 1000),
+        }
+        page_html = self.app.jinja_env.from_string(HTML_TEMPLATE).render(retry_ms=STREAM_RETRY_MS, **stream_settings)
+        self.page = CachedPage(page_html)
+        request_page_html = self.app.jinja_env.from_string(REQUEST_PAGE_TEMPLATE).render(max_length=REQUEST_MAX_LENGTH, poll_ms=REQUEST_POLL_INTERVAL_MS,
+                                                                                         **stream_settings)
+        self.request_page = CachedPage(request_page_html)
+        self.request_limiter = RateLimiter(REQUEST_RATE_LIMIT, REQUEST_RATE_PERIOD)
+
         self._setup_routes()
-        self.server_thread = threading.Thread(target=self._run_flask, daemon=True)
+        self.server_thread = threading.Thread(target=self._run_server, daemon=True)
+
+    def _count_requests(self, wsgi_app):
+        def counting_app(environ, start_response):
+            with self.request_lock:
+                self.active_requests += 1
+            try:
+                response = wsgi_app(environ, start_response)
+            except BaseException:
+                self._request_finished()
+                raise
+            return ClosingIterator(response, self._request_finished)
+
+        return counting_app
+
+    def _request_finished(self):
+        with self.request_lock:
+            self.active_requests -= 1
+
+    def get_channel(self, room):
+        # The channel of a room, it is created when it is used for the first time. The displays can't create rooms, they get 404 for unknown rooms.
+        if not ROOM_NAME_PATTERN.fullmatch(room):
+            raise ValueError(f'Invalid room name "{room}". Use up to 32 letters, digits, "-" and "_".')
+        with self.channels_lock:
+            channel = self.channels.get(room)
+            if channel is None:
+                channel = self.channels[room] = DisplayChannel(self, room)
+            return channel
+
+    def _get_event_log(self, room):
+        channel = self.channels.get(room)
+        return channel.event_log if channel else None
+
+    def _report_from_hub(self, room, report):
+        channel = self.channels.get(room)
+        if channel:
+            channel.report_player_state(report)
+
+    def display_url(self, room=DEFAULT_ROOM):
+        # The address which the displays of a room open. A server on all addresses is opened by its address in the local network,
+        # so the same address also works for the displays on other computers.
+        server_url = f"http://{get_lan_address() if self.host == '0.0.0.0' else self.host}:{self.port}"
+        display_url = f"{server_url}/" if room == DEFAULT_ROOM else f"{server_url}/display/{room}"
+        return f"{display_url}?key={self.display_key}" if self.display_key else display_url
+
+    def request_url(self, room=DEFAULT_ROOM):
+        # The address of the request page of a room for the phones of the guests. A server on all addresses is opened by its address in the local network.
+        server_url = f"http://{get_lan_address() if self.host == '0.0.0.0' else self.host}:{self.port}/request"
+        return server_url if room == DEFAULT_ROOM else f"{server_url}/{room}"
 
     def _setup_routes(self):
-        # Define all website paths
-        @self.app.route('/')
-        def index():
-            return render_template_string(HTML_TEMPLATE, video_url=self.current_video["url"])
+        # Define all website paths. Every path for the displays also exists with a room, the path without a room is for the default room.
+        @self.app.route('/', defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/display/<room>')
+        def index(room):
+            if room not in self.channels:
+                return Response("There is no such room.", status=404)
+            return self.page.response(request)
+
+        # The displays which use the event stream report the state of their player here, the WebSocket carries it to the hub instead
+        @self.app.route('/player-state', methods=["POST"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/player-state/<room>', methods=["POST"])
+        def player_state(room):
+            channel = self.channels.get(room)
+            if channel is None:
+                return Response("There is no such room.", status=404)
+            if self.display_key and not hmac.compare_digest(request.args.get("key", ""), self.display_key):
+                return Response("Invalid display key.", status=403)
+            report = request.get_json(silent=True)
+            if not isinstance(report, dict) or not channel.report_player_state(report):
+                return Response("Invalid player state.", status=400)
+            return Response(status=204)
 
         # Video Stream Path is responsible for providing the communication with the clients
-        @self.app.route('/video-stream')
-        def video_stream():
-            def event_stream(queue):
-                while True:
-                    url = queue.get()
-                    yield f"data: {url}\n\n"
+        @self.app.route('/video-stream', defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/video-stream/<room>')
+        def video_stream(room):
+            def event_stream(queue, events):
+                # Flask closes the generator when the client disconnects, so the subscriber is always removed again.
+                # A disconnect is only noticed while writing, so a heartbeat is sent regularly to find closed connections.
+                # Writing to a display which stopped reading fails after the time limit of the socket, which also ends the stream.
+                try:
+                    yield f"retry: {STREAM_RETRY_MS}\n\n" + "".join(format_event(event) for event in events)
+                    last_event_time = time.monotonic()
+                    while self.subscribers.contains(queue, room):
+                        try:
+                            message = queue.get(timeout=self.heartbeat_interval)
+                        except Empty:
+                            if time.monotonic() - last_event_time >= self.idle_timeout:
+                                return  # Free the thread, the display reconnects and resumes after the last event
+                            yield HEARTBEAT_EVENT
+                            continue
+                        if message is None:
+                            return  # The server is stopping
+                        last_event_time = time.monotonic()
+                        yield message
+                finally:
+                    self.subscribers.remove(queue, room)
+
+            channel = self.channels.get(room)
+            if channel is None:
+                return Response("There is no such room.", status=404)
+
+            # Register and read the missed events at the same time, so no event is lost or sent twice
+            last_event_id = get_last_event_id(request.headers, request.args)
+            phone = request.args.get("client") == "phone"
+            with channel.publish_lock:
+                q = self.subscribers.add(room, phone)
+                events = channel.event_log.get_events_after(last_event_id)
+            if not phone:
+                events = display_events(events)
+            if q is None:
+                return Response("Too many phones are connected." if phone else "Too many displays are connected.", status=503)
+            return Response(event_stream(q, events), mimetype="text/event-stream")
+
+        # The local files of the songs and the videos in the media cache, the displays play them instead of the YouTube video when the state contains their URL.
+        # Only files which belong to a song can be requested, the IDs of local files are registered when their song is played or cued.
+        @self.app.route('/media/<video_id>', methods=["GET", "HEAD"])
+        def media(video_id):
+            file_path = self.local_media.get(video_id)
+            if file_path is None and self.media_cache:
+                file_path = self.media_cache.get(video_id)
+            if file_path is None:
+                return Response("The video is not available.", status=404)
+            return send_media_file(request, file_path)
+
+        # The REST API of the song lists, so the rooms can also be controlled by scripts and without a window.
+        # All changes go through the engine of the room, which locks the song list, because the requests are handled by several threads at the same time.
+        @self.app.route('/api/queue', defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/queue')
+        def api_queue(room):
+            return self._api_call(room, lambda engine: json_response(engine.to_dict()))
+
+        @self.app.route('/api/songs', methods=["POST"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/songs', methods=["POST"])
+        def api_add_song(room):
+            def add_song(engine):
+                song = engine.add_song(*song_fields_from_json(request.get_json(silent=True)), allow_files=self._api_allows_files())
+                return json_response(song.to_dict(), status=201)
+
+            return self._api_call(room, add_song)
+
+        # PUT replaces all fields of a song, PATCH only the fields which are sent
+        @self.app.route('/api/songs/<song_id>', methods=["GET", "PUT", "PATCH", "DELETE"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/songs/<song_id>', methods=["GET", "PUT", "PATCH", "DELETE"])
+        def api_song(room, song_id):
+            def change_song(engine):
+                if request.method == "GET":
+                    return json_response(engine.get_song(song_id).to_dict())
+                if request.method == "DELETE":
+                    engine.delete_song(song_id)
+                    return Response(status=204)
+                with engine.lock:
+                    old_song = engine.get_song(song_id) if request.method == "PATCH" else None
+                    song = engine.edit_song(song_id, *song_fields_from_json(request.get_json(silent=True), old_song), allow_files=self._api_allows_files())
+                return json_response(song.to_dict())
+
+            return self._api_call(room, change_song)
+
+        @self.app.route('/api/songs/<song_id>/move', methods=["POST"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/songs/<song_id>/move', methods=["POST"])
+        def api_move_song(room, song_id):
+            def move_song(engine):
+                data = request.get_json(silent=True)
+                position = data.get("position") if isinstance(data, dict) else None
+                if not isinstance(position, int) or isinstance(position, bool):
+                    raise ValueError('"position" must be an integer.')
+                engine.move_song(song_id, position)
+                return json_response(engine.to_dict())
+
+            return self._api_call(room, move_song)
+
+        # Play the next song, the current song is moved to the end of the list unless "remove_current" is true
+        @self.app.route('/api/next', methods=["POST"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/next', methods=["POST"])
+        def api_next_song(room):
+            def next_song(engine):
+                data = request.get_json(silent=True) or {}
+                if not isinstance(data, dict):
+                    raise ValueError("The body must be a JSON object.")
+                if engine.next_song(remove_current=bool(data.get("remove_current"))) is None:
+                    return json_response({"error": "No songs in the list."}, status=409)
+                return json_response(engine.to_dict())
+
+            return self._api_call(room, next_song)
+
+        # Control the players of the displays, for example {"action": "seek", "seconds": 90}
+        @self.app.route('/api/player', methods=["POST"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/player', methods=["POST"])
+        def api_player(room):
+            def control_player(engine):
+                data = request.get_json(silent=True)
+                if not isinstance(data, dict):
+                    raise ValueError("The body must be a JSON object.")
+                seconds = data.get("seconds", 0)
+                if not isinstance(seconds, (int, float)) or isinstance(seconds, bool) or not math.isfinite(seconds) or seconds < 0:
+                    raise ValueError('"seconds" must be a number which is not negative.')
+                if not engine.control_player(data.get("action"), seconds):
+                    return json_response({"error": "No song is playing."}, status=409)
+                return json_response(engine.to_dict())
+
+            return self._api_call(room, control_player)
+
+        # Search the library of all songs which were ever added to the room (only the "sqlite" storage keeps one), for example to add a song again
+        @self.app.route('/api/library', defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/api/rooms/<room>/library')
+        def api_library(room):
+            def search_library(engine):
+                if not isinstance(engine.song_store, SongDatabase):
+                    return json_response({"error": 'There is no song library, it needs the "sqlite" storage backend.'}, status=404)
+                limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+                return json_response(engine.song_store.search(request.args.get("q", ""), limit))
+
+            return self._api_call(room, search_library)
+
+        # The numbers of server_stats, to watch the load of the server while tuning the backend, the workers and the stream mode
+        @self.app.route('/api/stats')
+        def api_stats():
+            if not self._api_authorized():
+                return json_response({"error": "Invalid token."}, status=401)
+            return json_response(self.server_stats())
+
+        # The request page for the phones of the guests. The songs are added by the engine of the room like in the window, which only shows them,
+        # so the requests are handled by the threads of the server. Every guest can only request a few songs within a while.
+        @self.app.route('/request', methods=["GET", "POST"], defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/request/<room>', methods=["GET", "POST"])
+        def song_request(room):
+            channel = self.channels.get(room)
+            engine = channel.queue_engine if channel else None
+            if engine is None:
+                return Response("There is no such room.", status=404)
+            if request.method == "GET":
+                return self.request_page.response(request)
+
+            # Only the songs which are added count for the limit, so a guest doesn't lose requests because of a wrong link.
+            # The engine is locked until the song is counted, so a guest can't send more songs at the same time.
+            try:
+                fields = song_fields_from_request(request.get_json(silent=True))
+            except ValueError as error:
+                return json_response({"error": str(error)}, status=400)
+            with engine.lock:
+                if engine.contains_song(fields[0], fields[3]):
+                    return json_response({"error": "You have already requested this song."}, status=409)
+                wait = self.request_limiter.check(request.remote_addr)
+                if wait:
+                    response = json_response({"error": f"You have requested too many songs, please try again in {int(wait) + 1} seconds."}, status=429)
+                    response.headers["Retry-After"] = str(int(wait) + 1)
+                    return response
+                try:
+                    song = engine.add_song(*fields)
+                except ValueError as error:
+                    return json_response({"error": str(error)}, status=400)
+                self.request_limiter.add(request.remote_addr)
+            return json_response({"id": song.id}, status=201)
+
+        # The queue for the request pages which can't use the event stream, because too many displays and phones are connected
+        @self.app.route('/song-queue', defaults={"room": DEFAULT_ROOM})
+        @self.app.route('/song-queue/<room>')
+        def song_queue(room):
+            channel = self.channels.get(room)
+            if channel is None:
+                return Response("There is no such room.", status=404)
+            return channel.get_queue_page().response(request)
+
+    def _api_authorized(self):
+        return not self.api_token or hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {self.api_token}")
+
+    def _api_allows_files(self):
+        # Local files can be read by the displays, so only a client with the token or on this computer can add them
+        return bool(self.api_token) or is_loopback_host(request.remote_addr)
+
+    def _api_call(self, room, action):
+        # Run an action of the REST API with the engine of the room and turn the errors into JSON responses.
+        # The changes must be sent as JSON, so the browser asks the server first (CORS) before a web page of another site can send them.
+        if not self._api_authorized():
+            return json_response({"error": "Invalid token."}, status=401)
+        if request.method in ("POST", "PUT", "PATCH") and not request.is_json:
+            return json_response({"error": 'The body must be JSON ("Content-Type: application/json").'}, status=415)
+        channel = self.channels.get(room)
+        engine = channel.queue_engine if channel else None
+        if engine is None:
+            return json_response({"error": "There is no such room."}, status=404)
+        try:
+            return action(engine)
+        except KeyError as error:
+            return json_response({"error": error.args[0]}, status=404)
+        except ValueError as error:
+            return json_response({"error": str(error)}, status=400)
+
+    @property
+    def subscriber_count(self):
+        # The number of displays which are currently connected to the event stream (in all rooms)
+        if self.broadcast_hub:
+            return self.broadcast_hub.client_count
+        return self.subscribers.count
+
+    @property
+    def phone_count(self):
+        # The number of request pages which are currently connected to the event stream
+        if self.broadcast_hub:
+            return self.broadcast_hub.phone_count
+        return self.subscribers.phone_count
+
+    def server_stats(self):
+        # Numbers to measure and tune the concurrency of the server
+        stats = {
+            "backend": self.server_backend,
+            "stream_mode": self.stream_mode,
+            "active_requests": self.active_requests,
+            "subscribers": self.subscriber_count,
+            "phones": self.phone_count,
+            "rooms": len(self.channels),
+        }
+        if self.broadcast_hub:
+            stats["stalled_subscribers"] = self.broadcast_hub.stalled_clients
+        if self.media_cache:
+            stats["cached_videos"] = self.media_cache.cached_count
+        if isinstance(self.http_server, PooledWSGIServer):
+            stats["workers"] = self.http_server.workers
+            stats["busy_workers"] = self.http_server.busy_workers
+            stats["queued_connections"] = self.http_server.queued_connections
+        return stats
+
+    def _run_server(self):
+        # The short poll interval makes shutting down fast. This also closes the socket when the server is shut down.
+        self.http_server.serve_forever(poll_interval=0.1)
+
+    def resolve_video(self, song):
+        # The video ID and the start time of a song or of a link, or None if it can't be played. Local files are registered, so the displays can request them.
+        # A song already knows its video from when it was created, only links are parsed.
+        if isinstance(song, Song):
+            video = (song.video_id, song.start, song.media_path) if song.video_id else None
+        else:
+            video = parse_song_link(song) if song else None
+        if video is None:
+            return None
+        video_id, start, media_path = video
+        if media_path:
+            self.local_media[video_id] = media_path
+        return video_id, start
+
+    def get_media_url(self, video_id):
+        # The URL of a local file or of the downloaded video, or None if the displays have to use the YouTube player.
+        # Videos which aren't downloaded yet are fetched for the next time.
+        if video_id in self.local_media:
+            return f"/media/{video_id}"
+        if not self.media_cache:
+            return None
+        if self.media_cache.get(video_id):
+            return f"/media/{video_id}"
+        self.media_cache.prefetch(video_id)
+        return None
 
-            q = Queue()
-            self.subscribers.append(q)
-            return Response(event_stream(q), mimetype="text/event-stream")
+    # The default room
+    @property
+    def current_video(self):
+        return self.default_channel.current_video
 
-    def _notify_clients(self):
-        for sub in self.subscribers:
-            sub.put(self.current_video["url"])
+    def report_player_state(self, report):
+        return self.default_channel.report_player_state(report)
 
-    def _run_flask(self):
-        self.app.run(host=self.host, port=self.port, debug=False, threaded=True)
+    def set_video(self, song, next_song=None, playing=True):
+        self.default_channel.set_video(song, next_song, playing)
 
-    def set_video(self, youtube_url):
-        # Check if the server is alive
-        if not self.server_thread.is_alive():
-            raise RuntimeError('No server is running. Please start it first with VideoServer.start()')
+    def cue_video(self, song):
+        self.default_channel.cue_video(song)
 
-        # Change the video of all clients by passing a valid YouTube URL to this function
-        if youtube_url:
-            try:
-                embed_url = youtube_url.replace("watch?v=", "embed/").split("&")[0]
-                embed_url += "?autoplay=1&cc_lang_policy=0&iv_load_policy=3"  # Remove the subtitles and make the video autoplay if possible
-                self.current_video["url"] = embed_url
-                self._notify_clients()
-                print(f"[VideoServer] Video changed to: {embed_url}")
-            except Exception as e:
-                print(f"[VideoServer] Error processing URL: {e}")
+    def play(self):
+        self.default_channel.play()
+
+    def pause(self):
+        self.default_channel.pause()
+
+    def seek(self, seconds):
+        self.default_channel.seek(seconds)
+
+    def set_next_video(self, next_song):
+        self.default_channel.set_next_video(next_song)
+
+    def set_queue(self, songs, current_song_id=None):
+        self.default_channel.set_queue(songs, current_song_id)
+
+    def set_countdown(self, seconds, song=None):
+        self.default_channel.set_countdown(seconds, song)
 
     def start(self):
-        # Start the server in the background
+        # Start the server in the background. The socket is bound here, so errors (like a used port) are raised by this function
+        if self.broadcast_hub:
+            self.broadcast_hub.start()
+        if self.media_cache:
+            self.media_cache.start()
+        if self.server_backend == "pool":
+            self.http_server = PooledWSGIServer(self.host, self.port, self.app, self.workers, self.write_timeout)
+        else:
+            self.http_server = ThreadedStoppableWSGIServer(self.host, self.port, self.app, socket_timeout=self.write_timeout)
         self.server_thread.start()
         server_url = f"http://{self.host}:{self.port}"
         print(f"[VideoServer] Server started at {server_url}")
+        if self.generated_token:
+            print(f"[VideoServer] The server can be reached from other devices, the token of the REST API is {self.api_token}")
         return server_url
 
-    """
-    Stopping the server is only possible by exiting the whole script.
-    """
+    def shutdown(self):
+        # Stop accepting new requests and release the port of the web server
+        if self.http_server:
+            self.http_server.shutdown()
+            self.server_thread.join()
 
+    def stop(self, timeout=2.0):
+        # Stop the server within the given time: release the ports, end all event streams, wait for the requests which are still running
+        # and finally close the connections which are still open (for example displays which stopped reading)
+        if not self.server_thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+
+        self.shutdown()
+        self.subscribers.close_all()
+        if self.broadcast_hub:
+            self.broadcast_hub.stop(timeout)
+        if self.media_cache:
+            self.media_cache.stop()
+
+        while self.active_requests and time.monotonic() < deadline:
+            time.sleep(0.02)
+        if self.active_requests:
+            print(f"[VideoServer] {self.active_requests} requests were still running and are cancelled")
+        self.http_server.close_connections()
+        print("[VideoServer] Server stopped")
+
+    def restart(self, timeout=2.0):
+        # Stop the server and start it again with the same settings. Threads can only be started once, so new ones are needed.
+        self.stop(timeout)
+        self.server_thread = threading.Thread(target=self._run_server, daemon=True)
+        if self.broadcast_hub:
+            hub = self.broadcast_hub
+            self.broadcast_hub = AsyncBroadcastHub(hub.get_event_log, hub.host, hub.port, hub.max_clients, hub.heartbeat_interval, hub.idle_timeout,
+                                                   hub.write_timeout, hub.on_report, hub.report_key, hub.max_phones)
+        return self.start()
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data), status=status, mimetype="application/json")
+
+
+def song_fields_from_json(data, song=None):
+    # The singer, the name, the author and the link of a song which was sent to the REST API. Missing fields are taken from the song (for PATCH).
+    if not isinstance(data, dict):
+        raise ValueError("The body must be a JSON object.")
+    fields = []
+    for key in ("person", "name", "author", "link"):
+        value = data.get(key, getattr(song, key, None))
+        if not isinstance(value, str):
+            raise ValueError(f'"{key}" must be a string.')
+        fields.append(value.strip())
+    return fields
+
+
+def song_fields_from_request(data):
+    # The fields of a song which a guest requested on the request page. They are checked again by the engine like the songs of the window,
+    # but guests can only request YouTube videos and no files of this computer.
+    person, name, author, link = song_fields_from_json(data)
+    if not person or not name:
+        raise ValueError("Please enter your name and the name of the song.")
+    if any(len(value) > REQUEST_MAX_LENGTH for value in (person, name, author, link)):
+        raise ValueError(f"The fields can have at most {REQUEST_MAX_LENGTH} characters.")
+    if not parse_youtube_link(link):
+        raise ValueError("Invalid YouTube link. Please correct it.")
+    return person, name, author, link
+
+
+def describe_request_url(video_server, room=DEFAULT_ROOM):
+    # The line in the window which tells the guests where they can request songs
+    if is_loopback_host(video_server.host):
+        return 'The phones can\'t reach the request page, set SERVER_HOST = "0.0.0.0" to allow it.'
+    return f"Request songs on your phone: {video_server.request_url(room)}"
+
+
+def describe_player_state(report):
+    # A short text for the GUI about what the player of a display is doing
+    if report["state"] == "error":
+        reason = YOUTUBE_PLAYER_ERRORS.get(report["error"], f"error {report['error']}")
+        return f"Display: The video can't be played ({reason})"
+    minutes, seconds = divmod(int(report["time"]), 60)
+    return f"Display: {report['state'].capitalize()} ({minutes}:{seconds:02d})"
+
+
+YOUTUBE_HOSTS = ("youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com")
+YOUTUBE_PATH_PREFIXES = ("shorts", "embed", "live", "v", "e")  # Paths like "/shorts/<video ID>"
+YOUTUBE_VIDEO_ID_PATTERN = re.compile(r'[\w-]{11}')
+YOUTUBE_TIME_PATTERN = re.compile(r'(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?')
+LOCAL_MEDIA_EXTENSIONS = (".mp4", ".m4v", ".webm", ".ogv", ".mkv", ".mp3", ".m4a", ".ogg", ".wav", ".cdg")  # Files which the browsers of the displays can play
+
+
+@lru_cache(maxsize=4096)
+def parse_youtube_link(link):
+    # The video ID and the start time (in seconds) of a YouTube link, or None if the link doesn't point to a video.
+    # This is the only place where links are parsed, and the result is cached, so checking or playing a link again costs nothing.
+    link = link.strip()
+    if "://" not in link:
+        link = "https://" + link
+    try:
+        parts = urlsplit(link)
+        host = (parts.hostname or "").removeprefix("www.")
+    except ValueError:
+        return None
+    query = parse_qs(parts.query)
+    path = [part for part in parts.path.split("/") if part]
+
+    # youtu.be/<ID>, youtube.com/watch?v=<ID> (also with a playlist) and youtube.com/shorts/<ID> and similar
+    video_id = None
+    if host == "youtu.be" and path:
+        video_id = path[0]
+    elif host in YOUTUBE_HOSTS:
+        if path == ["watch"]:
+            video_id = query.get("v", [None])[0]
+        elif len(path) >= 2 and path[0] in YOUTUBE_PATH_PREFIXES:
+            video_id = path[1]
+    if not video_id or not YOUTUBE_VIDEO_ID_PATTERN.fullmatch(video_id):
+        return None
 
-class KaraokeApp(QMainWindow):
+    # The start time is given as "t=90", "t=90s", "t=1m30s" or "start=90", it can also be in the fragment ("#t=90")
+    time_text = (query.get("t") or query.get("start") or parse_qs(parts.fragment).get("t") or [""])[0]
+    time_match = YOUTUBE_TIME_PATTERN.fullmatch(time_text)
+    start = 0
+    if time_match:
+        hours, minutes, seconds = (int(value or 0) for value in time_match.groups())
+        start = hours * 3600 + minutes * 60 + seconds
+    return video_id, start
+
+
+def parse_media_path(link):
+    # The absolute path of the file which is played for a link to a local file (a path or a file:// URL), or None for other links.
+    # CDG karaoke files come with an MP3 of the same name, which is played instead (the browsers can't show the CDG graphics).
+    link = link.strip().strip('"')
+    if link.lower().startswith("file:"):
+        link = url2pathname(urlsplit(link).path)
+    elif "://" in link:
+        return None
+    base, extension = path.splitext(link)
+    extension = extension.lower()
+    if extension not in LOCAL_MEDIA_EXTENSIONS:
+        return None
+    if extension == ".cdg":
+        link = next((base + audio_extension for audio_extension in (".mp3", ".MP3") if path.isfile(base + audio_extension)), base + ".mp3")
+    return path.abspath(link)
+
+
+def parse_song_link(link):
+    # The video ID, the start time and the path of the local file (None for YouTube) of the link of a song, or None if it can't be played.
+    # Local files get an ID from their path, so the displays can tell them apart like YouTube videos.
+    video = parse_youtube_link(link)
+    if video:
+        return video[0], video[1], None
+    media_path = parse_media_path(link)
+    if media_path:
+        return "file-" + hashlib.sha1(path.normcase(media_path).encode()).hexdigest()[:16], 0, media_path
+    return None
+
+
+def is_playable_link(link, allow_files=True):
+    # A YouTube video or a local file which exists
+    video = parse_song_link(link)
+    return video is not None and (video[2] is None or (allow_files and path.isfile(video[2])))
+
+
+def is_loopback_host(host):
+    # Whether only this computer can use the address (like 127.0.0.1), "0.0.0.0" is reachable from other devices
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def get_lan_address():
+    # The address of this computer in the local network. Connecting a UDP socket sends nothing, it only chooses the network interface.
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+            udp_socket.connect(("10.255.255.255", 1))
+            return udp_socket.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"  # There is no network
+
+
+def song_fields_from_row(row):
+    # The singer, the name, the author and the link of a row of an import file. The link is always the last column,
+    # so a list of links (like an exported playlist) can be imported as well.
+    row = [cell.strip() for cell in row]
+    fields = (row[:-1] + ["", "", ""])[:3]
+    return fields[0], fields[1], fields[2], row[-1]
+
+
+def read_song_csv(file):
+    # The first row can contain the names of the columns, otherwise the columns are in the same order as in the GUI
+    rows = csv.reader(file)
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    column_names = [cell.strip().lower() for cell in first_row]
+    columns = {}
+    for field_name, names in SONG_IMPORT_COLUMNS.items():
+        for index, column_name in enumerate(column_names):
+            if column_name in names:
+                columns[field_name] = index
+    if "link" not in columns:
+        if any(first_row):
+            yield song_fields_from_row(first_row)
+        for row in rows:
+            if any(row):
+                yield song_fields_from_row(row)
+        return
+
+    for row in rows:
+        if any(row):
+            yield tuple(row[columns[field_name]].strip() if field_name in columns and columns[field_name] < len(row) else "" for field_name in SONG_IMPORT_COLUMNS)
+
+
+def read_song_json(file):
+    # Either a list of songs (like the song file) or one song per line. A song is an object with the fields of a song or only a link.
+    first_character = file.read(1)
+    while first_character.isspace():
+        first_character = file.read(1)
+    file.seek(0)
+    if first_character == "[":
+        items = json.load(file)
+    else:
+        items = (json.loads(line) for line in file if line.strip())
+    for item in items:
+        if isinstance(item, str):
+            yield "", "", "", item.strip()
+        elif isinstance(item, dict):
+            yield tuple(str(item.get(field_name) or "").strip() for field_name in SONG_IMPORT_COLUMNS)
+        else:
+            yield "", "", "", ""  # Other values (like numbers) have no link, so they are counted as skipped
+
+
+def read_song_text(file):
+    # One link per line, or the singer, the name, the author and the link separated by tabs. Lines starting with "#" are comments.
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield song_fields_from_row(line.split("\t"))
+
+
+def read_song_file(file_path):
+    # Read the songs of an import file one by one, so the file is never completely in memory (except a JSON list).
+    # The type of the file is chosen by its extension, every unknown extension is read as a text file.
+    extension = path.splitext(file_path)[1].lower()
+    with open(file_path, encoding="utf-8-sig", newline="") as file:
+        if extension == ".csv":
+            yield from read_song_csv(file)
+        elif extension in (".json", ".jsonl"):
+            yield from read_song_json(file)
+        else:
+            yield from read_song_text(file)
+
+
+def create_imported_songs(rows, song_list):
+    # Create the songs with a valid link which aren't in the list yet (the same singer with the same video), also not twice from the same file.
+    # Returns the new songs and the number of rows which were skipped.
+    known_songs = {(song.person.casefold(), song.video_id) for song in song_list}
+    songs = []
+    skipped = 0
+    for person, name, author, link in rows:
+        song = Song(person, name, author, link)
+        key = (person.casefold(), song.video_id)
+        if song.video_id is None or (song.media_path and not path.isfile(song.media_path)) or key in known_songs:
+            skipped += 1
+            continue
+        known_songs.add(key)
+        songs.append(song)
+    return songs, skipped
+
+
+def new_song_id():
+    return uuid.uuid4().hex[:16]
+
+
+@dataclass(frozen=True, slots=True)
+class Song:
+    # A song in the list. It can't be changed, an edited song is a new record with the same id.
+    # The id stays the same as long as the song exists, so two songs with the same data can still be told apart.
+    # The video ID and the start time are taken from the link when the song is created, and they are saved with the song.
+    # The link is either a YouTube link or the path of a local file, which is then also saved as media_path.
+    person: str
+    name: str
+    author: str
+    link: str
+    id: str = field(default_factory=new_song_id)
+    video_id: str | None = None
+    start: int = 0
+    media_path: str | None = None
+
+    def __post_init__(self):
+        if self.video_id is None:
+            video = parse_song_link(self.link)
+            if video:
+                object.__setattr__(self, "video_id", video[0])
+                object.__setattr__(self, "start", video[1])
+                object.__setattr__(self, "media_path", video[2])
+
+    @classmethod
+    def from_dict(cls, song_data):
+        # Songs saved by older versions have no id and no video ID yet
+        return cls(song_data["person"], song_data["name"], song_data["author"], song_data["link"], song_data.get("id") or new_song_id(),
+                   song_data.get("video_id"), song_data.get("start", 0), song_data.get("media_path"))
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def song_to_json(value):
+    # Used as the default function for json.dump, so songs can be written directly
+    if isinstance(value, Song):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class SongQueue:
+    def __init__(self, songs=()):
+        # The list of the songs together with the position of every song id, so a song can be found without searching the list.
+        # All changes go through the methods below, which keep the positions up to date and return the operation for the storage.
+        self.songs = list(songs)
+        self.positions = {}
+        self._update_positions(0, len(self.songs))
+
+    def _update_positions(self, start, end):
+        for index in range(start, end):
+            self.positions[self.songs[index].id] = index
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def index_of(self, song_id):
+        # The position of the song with this id, or None if it is not in the list
+        return self.positions.get(song_id)
+
+    def append(self, song):
+        self.songs.append(song)
+        self.positions[song.id] = len(self.songs) - 1
+        return "add", song
+
+    def replace(self, index, song):
+        old_song = self.songs[index]
+        self.songs[index] = song
+        if old_song.id != song.id:
+            del self.positions[old_song.id]
+            self.positions[song.id] = index
+        return "edit", index, song
+
+    def delete(self, index):
+        song = self.songs.pop(index)
+        del self.positions[song.id]
+        self._update_positions(index, len(self.songs))  # Only the songs after it have moved
+        return "delete", index
+
+    def move(self, index, new_index):
+        self.songs.insert(new_index, self.songs.pop(index))
+        self._update_positions(min(index, new_index), max(index, new_index) + 1)  # Only the songs in between have moved
+        return "move", index, new_index
+
+    def extend(self, songs):
+        # Add many songs as one operation, so they are saved at once
+        start = len(self.songs)
+        self.songs.extend(songs)
+        self._update_positions(start, len(self.songs))
+        return "add_many", list(songs)
+
+
+def write_json_file(file_path, data, indent=4):
+    # Write into a temporary file and replace the old file with it, so the file is never only half written
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file, indent=indent, default=song_to_json)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+
+def apply_song_operation(song_list, operation):
+    # Change the song list the same way as the GUI did when the operation was recorded (the songs in the journal are dicts)
+    action = operation[0]
+    if action == "add":
+        song_list.append(Song.from_dict(operation[1]))
+    elif action == "add_many":
+        song_list.extend(Song.from_dict(song_data) for song_data in operation[1])
+    elif action == "edit":
+        song_list[operation[1]] = Song.from_dict(operation[2])
+    elif action == "delete":
+        del song_list[operation[1]]
+    elif action == "move":
+        song_list.insert(operation[2], song_list.pop(operation[1]))
+    else:
+        raise ValueError(f'Unknown song operation "{action}"')
+
+
+class SongFileWriter:
+    def __init__(self, file_path=SONG_FILE, delay=0.5):
+        # Writes the song list in a background thread, so the GUI never waits for the disk.
+        # All changes which happen within the delay after a change are written together.
+        self.file_path = file_path
+        self.delay = delay
+        self.pending_song_list = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.writer_thread = threading.Thread(target=self._run, daemon=True)
+        self.writer_thread.start()
+
+    def load(self):
+        if path.exists(self.file_path):
+            with open(self.file_path) as file:
+                return [Song.from_dict(song_data) for song_data in json.load(file)]
+        return []
+
+    def save(self, song_list, operation=None):
+        # The whole list is always written, so the operation is not needed.
+        # Only a copy of the list is made here. The songs themselves can't be changed, so they can be shared with the writer thread.
+        with self.condition:
+            self.pending_song_list = list(song_list)
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending_song_list is not None or self.closed)
+                # Wait for more changes, but don't wait if the writer is being closed
+                self.condition.wait_for(lambda: self.closed, timeout=self.delay)
+                song_list, self.pending_song_list = self.pending_song_list, None
+                closed = self.closed
+
+            if song_list is not None:
+                try:
+                    write_json_file(self.file_path, song_list)
+                except OSError as e:
+                    print(f"[SongFileWriter] Error saving the songs: {e}")
+            if closed:
+                return
+
+    def song_played(self, song):
+        pass  # Only the song list is saved
+
+    def close(self):
+        # Write the last changes immediately and wait until they are written
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.writer_thread.join()
+
+
+class SongJournal:
+    def __init__(self, journal_path=SONG_JOURNAL_FILE, snapshot_path=SONG_SNAPSHOT_FILE, compact_after=500, song_file=SONG_FILE):
+        # Every change of the song list is appended as one line to the journal, so saving doesn't depend on the length of the list.
+        # After some changes the whole list is written into a snapshot and the journal starts again empty.
+        # Every line has a sequence number and the snapshot knows the number of the last change it contains,
+        # so if the program stops between writing the snapshot and emptying the journal, no change is applied twice.
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.compact_after = compact_after
+        self.song_file = song_file  # The file of the JSON storage, which is read once when the journal is used for the first time
+        self.sequence = 0
+        self.operations_since_snapshot = 0
+        self.journal_file = None
+
+    def load(self):
+        # Start with the snapshot (or with the file of the JSON storage when the journal is used for the first time)
+        song_list = []
+        snapshot_sequence = 0
+        if path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+            song_list = [Song.from_dict(song_data) for song_data in snapshot["songs"]]
+            snapshot_sequence = snapshot["sequence"]
+        elif path.exists(self.song_file):
+            with open(self.song_file) as file:
+                song_list = [Song.from_dict(song_data) for song_data in json.load(file)]
+        self.sequence = snapshot_sequence
+
+        # Apply all changes which happened after the snapshot
+        if path.exists(self.journal_path):
+            with open(self.journal_path) as file:
+                for line in file:
+                    try:
+                        sequence, *operation = json.loads(line)
+                    except ValueError:
+                        print("[SongJournal] The journal ends with an incomplete change, it is ignored")
+                        break
+                    if sequence > snapshot_sequence:
+                        apply_song_operation(song_list, operation)
+                        self.sequence = sequence
+
+        # Start with a fresh snapshot, so an incomplete line at the end of the journal is removed
+        self.compact(song_list)
+        return song_list
+
+    def save(self, song_list, operation=None):
+        # Without an operation it is unknown what changed, so the whole list is saved
+        if operation is None or self.operations_since_snapshot >= self.compact_after:
+            self.compact(song_list)
+            return
+
+        # The line is passed to the operating system immediately, so it is kept even if the program crashes afterward
+        self.sequence += 1
+        self.journal_file.write(json.dumps([self.sequence, *operation], default=song_to_json) + "\n")
+        self.journal_file.flush()
+        self.operations_since_snapshot += 1
+
+    def compact(self, song_list):
+        # The snapshot contains everything up to the current sequence number, so the journal can be emptied afterward
+        self.sequence += 1
+        write_json_file(self.snapshot_path, {"sequence": self.sequence, "songs": list(song_list)})
+
+        if self.journal_file:
+            self.journal_file.close()
+        self.journal_file = open(self.journal_path, "w")
+        self.operations_since_snapshot = 0
+
+    def song_played(self, song):
+        pass  # Only the song list is saved
+
+    def close(self):
+        if self.journal_file:
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.journal_file.close()
+            self.journal_file = None
+
+
+class SongDatabase:
+    def __init__(self, database_path=SONG_DATABASE_FILE, song_file=SONG_FILE):
+        # The library contains every song which was ever added, with indexes for searching, and the queue only points to the songs in it.
+        # The WAL mode lets reading continue while a change is written, and the lock allows using the database from several threads.
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.song_file = song_file  # The file of the JSON storage, which is read once when the database is used for the first time
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS songs (
+                    id INTEGER PRIMARY KEY,
+                    person TEXT NOT NULL COLLATE NOCASE,
+                    name TEXT NOT NULL COLLATE NOCASE,
+                    author TEXT NOT NULL COLLATE NOCASE,
+                    link TEXT NOT NULL,
+                    video_id TEXT,
+                    added_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    play_count INTEGER NOT NULL DEFAULT 0,
+                    last_played_at TEXT,
+                    UNIQUE (person, name, author, link)
+                );
+                CREATE INDEX IF NOT EXISTS songs_person ON songs (person);
+                CREATE INDEX IF NOT EXISTS songs_name ON songs (name);
+                CREATE INDEX IF NOT EXISTS songs_author ON songs (author);
+                CREATE INDEX IF NOT EXISTS songs_video_id ON songs (video_id);
+                CREATE TABLE IF NOT EXISTS queue (
+                    position INTEGER PRIMARY KEY,
+                    song_id INTEGER NOT NULL REFERENCES songs (id),
+                    entry_id TEXT
+                );
+            """)
+
+            # Databases of older versions don't have the ids of the songs in the queue yet
+            queue_columns = [row[1] for row in self.connection.execute("PRAGMA table_info(queue)")]
+            if "entry_id" not in queue_columns:
+                self.connection.execute("ALTER TABLE queue ADD COLUMN entry_id TEXT")
+
+    def _add_to_library(self, song):
+        # Returns the id of the song in the library, it is only added if it is not in the library yet
+        values = (song.person, song.name, song.author, song.link)
+        self.connection.execute(
+            "INSERT OR IGNORE INTO songs (person, name, author, link, video_id) VALUES (?, ?, ?, ?, ?)",
+            (*values, song.video_id)
+        )
+        return self.connection.execute("SELECT id FROM songs WHERE person = ? AND name = ? AND author = ? AND link = ?", values).fetchone()[0]
+
+    def load(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT songs.person, songs.name, songs.author, songs.link, queue.entry_id FROM queue JOIN songs ON songs.id = queue.song_id ORDER BY queue.position"
+            ).fetchall()
+            is_new = self.connection.execute("SELECT NOT EXISTS (SELECT 1 FROM songs)").fetchone()[0]
+
+        # When the database is used for the first time, start with the songs of the JSON storage
+        if is_new and path.exists(self.song_file):
+            with open(self.song_file) as file:
+                song_list = [Song.from_dict(song_data) for song_data in json.load(file)]
+            self.save(song_list)
+            return song_list
+
+        return [Song(person, name, author, link, entry_id or new_song_id()) for person, name, author, link, entry_id in rows]
+
+    def save(self, song_list, operation=None):
+        # The queue is small, so it is simply written again. The songs stay in the library when they are removed from the queue.
+        with self.lock, self.connection:
+            rows = [(position, self._add_to_library(song), song.id) for position, song in enumerate(song_list)]
+            self.connection.execute("DELETE FROM queue")
+            self.connection.executemany("INSERT INTO queue (position, song_id, entry_id) VALUES (?, ?, ?)", rows)
+
+    def song_played(self, song):
+        with self.lock, self.connection:
+            song_id = self._add_to_library(song)
+            self.connection.execute("UPDATE songs SET play_count = play_count + 1, last_played_at = CURRENT_TIMESTAMP WHERE id = ?", (song_id,))
+
+    def search(self, text, limit=50):
+        # Find songs where the singer, the name or the author starts with the text (this uses the indexes), or with this video ID
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT person, name, author, link, play_count, last_played_at FROM songs
+                WHERE person LIKE :pattern ESCAPE '\\' OR name LIKE :pattern ESCAPE '\\' OR author LIKE :pattern ESCAPE '\\' OR video_id = :text
+                ORDER BY last_played_at DESC LIMIT :limit
+                """,
+                {"pattern": pattern, "text": text, "limit": limit}
+            ).fetchall()
+        return [
+            {"person": person, "name": name, "author": author, "link": link, "play_count": play_count, "last_played_at": last_played_at}
+            for person, name, author, link, play_count, last_played_at in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def room_file_path(file_path, room):
+    # Every room has its own song files, the default room uses the files without the name of the room (like before there were rooms)
+    if room == DEFAULT_ROOM:
+        return file_path
+    base, extension = path.splitext(file_path)
+    return f"{base}_{room}{extension}"
+
+
+def create_song_store(backend=STORAGE_BACKEND, room=DEFAULT_ROOM):
+    song_file = room_file_path(SONG_FILE, room)
+    if backend == "json":
+        return SongFileWriter(song_file)
+    if backend == "journal":
+        return SongJournal(room_file_path(SONG_JOURNAL_FILE, room), room_file_path(SONG_SNAPSHOT_FILE, room), song_file=song_file)
+    if backend == "sqlite":
+        return SongDatabase(room_file_path(SONG_DATABASE_FILE, room), song_file)
+    raise ValueError(f'Unknown storage backend "{backend}". Use "json", "journal" or "sqlite".')
+
+
+class QueueEngine:
+    def __init__(self, channel, song_store, auto_advance=AUTO_ADVANCE, countdown_seconds=COUNTDOWN_SECONDS, auto_advance_delay=AUTO_ADVANCE_DELAY):
+        # The song list of one room and everything which happens with it: adding, editing, deleting and moving songs, playing the next song
+        # with the countdown before it and starting the next song automatically when the displays report the end of the video.
+        # It doesn't depend on a GUI, so it also runs headless and is controlled by the REST API of the server. The methods can be called from any thread,
+        # the lock keeps the list, the storage and the displays consistent. Every change increases the version, so the GUIs notice changes from other threads.
+        self.channel = channel
+        self.song_store = song_store
+        self.lock = threading.RLock()
+        self.song_list = SongQueue(song_store.load())
+        self.current_song = None
+        self.current_song_start_time = None
+        self.player_state = None  # The newest report of a display about the current video
+        self.auto_advance = auto_advance
+        self.auto_advance_delay = auto_advance_delay
+        self.auto_advance_deadline = None  # The time (of time.monotonic) when the next song is started automatically
+        self.countdown_length = countdown_seconds
+        self.countdown_seconds = 0
+        self.countdown_deadline = None  # The time of the next step of the countdown while a song is about to start
+        self.version = 0
+        channel.queue_engine = self  # The REST API finds the engine of a room through its channel
+        with self.lock:
+            self._publish_queue()
+
+        # The reports of the displays and the timers are handled by one thread in the background
+        self.running = True
+        self.worker_thread = threading.Thread(target=self._run, daemon=True)
+        self.worker_thread.start()
+
+    def _run(self):
+        # Wait for the next report, but at most until the next timer is due. The time limit also makes stopping fast.
+        while self.running:
+            with self.lock:
+                deadlines = [deadline for deadline in (self.countdown_deadline, self.auto_advance_deadline) if deadline is not None]
+            timeout = PLAYER_REPORT_INTERVAL_MS / 1000
+            if deadlines:
+                timeout = max(0, min(timeout, min(deadlines) - time.monotonic()))
+            report = self.channel.wait_player_report(timeout)
+
+            with self.lock:
+                if report:
+                    self._handle_player_report(report)
+                now = time.monotonic()
+                if self.countdown_deadline is not None and now >= self.countdown_deadline:
+                    self._countdown_tick()
+                if self.auto_advance_deadline is not None and now >= self.auto_advance_deadline:
+                    self.auto_advance_deadline = None
+                    self._next_song(remove_current=True)  # The song has been sung, so it is removed without asking
+
+    def close(self):
+        # Stop the thread and write the last changes of the songs, the REST API of the room stops with it
+        self.channel.queue_engine = None
+        self.running = False
+        self.worker_thread.join()
+        with self.lock:
+            self.song_store.close()
+
+    def _changed(self):
+        self.version += 1
+
+    def _save(self, operation):
+        # The operation describes the change (like ("move", 3, 2)), so the storage can save only the change
+        self.song_store.save(self.song_list, operation)
+        self._publish_queue()
+        self._changed()
+
+    def _publish_queue(self):
+        # Send the song list to the displays. The song which the displays load in the background might also be a different one now.
+        current_song_id = self.current_song.id if self.current_song else None
+        self.channel.set_queue(self.song_list, current_song_id)
+        self.channel.set_next_video(self._get_next_song())
+
+    def _get_next_song(self):
+        # The song which "Play Next Song" would start (the first song which isn't the current one)
+        current_index = self.song_list.index_of(self.current_song.id) if self.current_song else None
+        for index, song in enumerate(self.song_list[:2]):
+            if index != current_index:
+                return song
+        return None
+
+    def _find(self, song_id):
+        index = self.song_list.index_of(song_id)
+        if index is None:
+            raise KeyError(f"There is no song with the id {song_id}.")
+        return index
+
+    def get_song(self, song_id):
+        with self.lock:
+            return self.song_list[self._find(song_id)]
+
+    def add_song(self, person, name, author, link, allow_files=True):
+        # Returns the new song. Raises ValueError if the link can't be played (or is a local file which isn't allowed).
+        if not is_playable_link(link, allow_files):
+            raise ValueError("Invalid YouTube link or media file." if allow_files else "Invalid YouTube link, local files are not allowed.")
+        song = Song(person, name, author, link)
+        with self.lock:
+            self._save(self.song_list.append(song))
+        return song
+
+    def edit_song(self, song_id, person, name, author, link, allow_files=True):
+        # The edited song keeps its id, so it stays the same song (also when it is the current song). Raises KeyError if the song was deleted.
+        if not is_playable_link(link, allow_files):
+            raise ValueError("Invalid YouTube link or media file." if allow_files else "Invalid YouTube link, local files are not allowed.")
+        song = Song(person, name, author, link, song_id)
+        with self.lock:
+            index = self._find(song_id)
+            if self.current_song and self.current_song.id == song_id:
+                self.current_song = song
+            self._save(self.song_list.replace(index, song))
+        return song
+
+    def delete_song(self, song_id):
+        with self.lock:
+            self._save(self.song_list.delete(self._find(song_id)))
+
+    def move_song(self, song_id, position):
+        # Move the song to the position, a position outside the list moves it to the start or the end
+        with self.lock:
+            index = self._find(song_id)
+            position = max(0, min(position, len(self.song_list) - 1))
+            if position != index:
+                self._save(self.song_list.move(index, position))
+
+    def import_songs(self, rows):
+        # The file is read before the lock is taken, then all new songs are saved at once. Returns the new songs and the number of skipped rows.
+        rows = list(rows)
+        with self.lock:
+            songs, skipped = create_imported_songs(rows, self.song_list)
+            if songs:
+                self._save(self.song_list.extend(songs))
+        return songs, skipped
+
+    def contains_song(self, person, link):
+        # Whether the singer already has a song with the video of the link in the list (the same check as for imported songs)
+        video = parse_song_link(link)
+        with self.lock:
+            return video is not None and any(song.person.casefold() == person.casefold() and song.video_id == video[0] for song in self.song_list)
+
+    def current_song_in_list(self):
+        with self.lock:
+            return self.current_song is not None and self.song_list.index_of(self.current_song.id) is not None
+
+    def next_song(self, remove_current=False, expected_current_id=None):
+        # Start the first song of the list. The current song is removed from the list or moved to the end of it.
+        # Returns the new current song, or None if the list is empty. The window asks whether the current song should be removed, and the song
+        # can change while it asks (auto advance, the REST API), so with expected_current_id nothing happens unless that song is still the current one.
+        with self.lock:
+            if expected_current_id is not None and (self.current_song is None or self.current_song.id != expected_current_id):
+                return None
+            return self._next_song(remove_current)
+
+    def _next_song(self, remove_current):
+        self.auto_advance_deadline = None
+        self._stop_countdown()
+
+        operation = None
+        if self.current_song is not None:
+            current_index = self.song_list.index_of(self.current_song.id)
+            if current_index is not None:
+                if remove_current:
+                    operation = self.song_list.delete(current_index)
+                else:
+                    operation = self.song_list.move(current_index, len(self.song_list) - 1)
+
+        # If there are any songs in the list set the current song to the newest one, load the song on the displays and start the countdown
+        next_song = None
+        if self.song_list:
+            next_song = self.current_song = self.song_list[0]
+            self.current_song_start_time = None
+            self.player_state = None
+            self.channel.set_video(next_song, self._get_next_song(), playing=False)
+            self._publish_queue()
+            self.song_store.song_played(next_song)
+            self._start_countdown()
+
+        # The list only changes if there was a current song
+        if operation:
+            self._save(operation)
+        self._changed()
+        return next_song
+
+    @property
+    def countdown_running(self):
+        return self.countdown_deadline is not None
+
+    def _start_countdown(self):
+        # Every second of the countdown is also sent to the displays, so they all show the same countdown
+        self.countdown_seconds = self.countdown_length
+        if self.countdown_seconds <= 0:
+            self._start_current_song()
+            return
+        self.countdown_deadline = time.monotonic() + 1
+        self.channel.set_countdown(self.countdown_seconds, self.current_song)
+
+    def _countdown_tick(self):
+        self.countdown_seconds -= 1
+        if self.countdown_seconds > 0:
+            self.countdown_deadline += 1
+            self.channel.set_countdown(self.countdown_seconds, self.current_song)
+        else:
+            self.countdown_deadline = None
+            self.channel.set_countdown(0)
+            self._start_current_song()
+        self._changed()
+
+    def stop_countdown(self):
+        # The song stays loaded on the displays, but it isn't started
+        with self.lock:
+            self._stop_countdown()
+            self._changed()
+
+    def _stop_countdown(self):
+        if self.countdown_deadline is None:
+            return
+        self.countdown_deadline = None
+        self.channel.set_countdown(0)
+
+    def _start_current_song(self):
+        self.channel.play()
+        self.current_song_start_time = datetime.now().strftime('%H:%M:%S')
+
+    def control_player(self, action, seconds=0):
+        # Play, pause, jump to the seconds ("seek") or stop the current song on the displays ("stop" loads it again without starting it).
+        # A countdown or an automatic advance which is waiting is cancelled. Returns False if there is no current song.
+        if action not in PLAYER_ACTIONS:
+            raise ValueError(f'Unknown action "{action}". Use "play", "pause", "seek" or "stop".')
+        with self.lock:
+            if self.current_song is None:
+                return False
+            self._stop_countdown()
+            self.auto_advance_deadline = None
+            if action == "play":
+                self._start_current_song()
+            elif action == "pause":
+                self.channel.pause()
+            elif action == "seek":
+                self.channel.seek(seconds)
+            else:
+                self.channel.cue_video(self.current_song)
+            self._changed()
+            return True
+
+    def set_auto_advance(self, enabled):
+        with self.lock:
+            self.auto_advance = enabled
+            if not enabled:
+                self.auto_advance_deadline = None
+            self._changed()
+
+    def _handle_player_report(self, report):
+        # Only reports about the video which should be playing right now count, older reports might arrive late
+        if report["video_id"] != self.channel.current_video["video_id"]:
+            return
+        self.player_state = report
+        self._changed()
+
+        # Every display reports the end of the video, but the next song is only scheduled once
+        if report["state"] == "ended" and self.auto_advance and self.auto_advance_deadline is None and self.song_list:
+            self.auto_advance_deadline = time.monotonic() + self.auto_advance_delay
+
+    def to_dict(self):
+        # The whole state of the song list for the REST API
+        with self.lock:
+            return {
+                "room": self.channel.room,
+                "songs": [song.to_dict() for song in self.song_list],
+                "current_song": self.current_song.to_dict() if self.current_song else None,
+                "started_at": self.current_song_start_time,
+                "countdown": self.countdown_seconds if self.countdown_running else 0,
+                "auto_advance": self.auto_advance,
+                "player_state": self.player_state,
+                "version": self.version,
+            }
+
+
+def run_headless(host=HEADLESS_HOST, port=5000):
+    # Run the server and the song lists of all rooms without a window, for example on a small Linux computer next to the displays.
+    # The song lists are controlled with the REST API (/api/... and /api/rooms/<room>/...), the program runs until it is stopped with Ctrl+C.
+    video_server = VideoServer(host, port, stream_mode=STREAM_MODE, server_backend=SERVER_BACKEND, media_cache=create_media_cache() if MEDIA_CACHE else None)
+    video_server.start()
+    engines = []
+    for room in dict.fromkeys((DEFAULT_ROOM, *ROOMS)):
+        engines.append(QueueEngine(video_server.get_channel(room), create_song_store(STORAGE_BACKEND, room)))
+        print(f"[VideoServer] Room {room}: displays at {video_server.display_url(room)}, song requests at {video_server.request_url(room)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for engine in engines:
+        engine.close()
+    video_server.stop()
+
+
+class SongListModel(QAbstractListModel):
     def __init__(self):
+        # The list view asks this model for the rows it displays, so only the visible rows are ever drawn
+        super().__init__()
+        self.songs = []
+        self.current_song_id = None
+        self.edit_mode = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.songs)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        song_data = self.songs[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f'Singer: {song_data.person} | "{song_data.name}" by {song_data.author} | Link: {song_data.link}'
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return QColor("green") if song_data.id == self.current_song_id else QColor("black")
+        return None
+
+    def update_songs(self, songs, current_song_id, edit_mode):
+        # Compare the new list with the displayed one and only report the rows which are different.
+        # The songs at the start and at the end which are still the same objects are skipped, the rows in between are changed,
+        # and if the length is different the remaining rows are inserted or removed.
+        start = 0
+        while start < len(self.songs) and start < len(songs) and self.songs[start] is songs[start]:
+            start += 1
+
+        old_end = len(self.songs)
+        new_end = len(songs)
+        while old_end > start and new_end > start and self.songs[old_end - 1] is songs[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+
+        changed_rows = min(old_end, new_end) - start
+        if changed_rows > 0:
+            self.songs[start:start + changed_rows] = songs[start:start + changed_rows]
+            self.dataChanged.emit(self.index(start), self.index(start + changed_rows - 1))
+
+        first_row = start + changed_rows
+        if old_end > new_end:
+            self.beginRemoveRows(QModelIndex(), first_row, old_end - 1)
+            del self.songs[first_row:old_end]
+            self.endRemoveRows()
+        elif new_end > old_end:
+            self.beginInsertRows(QModelIndex(), first_row, new_end - 1)
+            self.songs[first_row:first_row] = songs[first_row:new_end]
+            self.endInsertRows()
+
+        # The colors and the buttons can change for any row, but the view only repaints the rows which are visible
+        if current_song_id != self.current_song_id or edit_mode != self.edit_mode:
+            self.current_song_id = current_song_id
+            self.edit_mode = edit_mode
+            if self.songs:
+                self.dataChanged.emit(self.index(0), self.index(len(self.songs) - 1))
+
+
+class SongItemDelegate(QStyledItemDelegate):
+    # Draws the edit buttons into the rows of the list view and reports clicks on them, so no widgets are needed for the rows
+    button_clicked = pyqtSignal(str, int)  # The text of the button and the row
+
+    BUTTON_TEXTS = ("Edit", "Delete", "↑", "↓")
+    BUTTON_HEIGHT = 26
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.model = model
+
+    def button_rects(self, option):
+        # The buttons are placed next to each other at the right side of the row
+        rects = []
+        right = option.rect.right()
+        for text in reversed(self.BUTTON_TEXTS):
+            width = option.fontMetrics.horizontalAdvance(text) + 20
+            rects.insert(0, QRect(right - width + 1, option.rect.top() + 1, width - 2, option.rect.height() - 2))
+            right -= width
+        return rects
+
+    def paint(self, painter, option, index):
+        if not self.model.edit_mode:
+            super().paint(painter, option, index)
+            return
+
+        # Make the text smaller so it doesn't go below the buttons
+        rects = self.button_rects(option)
+        text_option = QStyleOptionViewItem(option)
+        text_option.rect = QRect(option.rect.left(), option.rect.top(), rects[0].left() - option.rect.left(), option.rect.height())
+        super().paint(painter, text_option, index)
+
+        style = option.widget.style() if option.widget else QApplication.style()
+        for text, rect in zip(self.BUTTON_TEXTS, rects):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = text
+            button.state = QStyle.StateFlag.State_Enabled | QStyle.StateFlag.State_Raised
+            style.drawControl(QStyle.ControlElement.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if self.model.edit_mode and event.type() == QEvent.Type.MouseButtonRelease:
+            for text, rect in zip(self.BUTTON_TEXTS, self.button_rects(option)):
+                if rect.contains(event.position().toPoint()):
+                    self.button_clicked.emit(text, index.row())
+                    return True
+        return super().editorEvent(event, model, option, index)
+
+    def sizeHint(self, option, index):
+        # All rows have the same height (also in the edit mode), so the view can calculate the position of every row directly
+        size = super().sizeHint(option, index)
+        size.setHeight(max(size.height(), self.BUTTON_HEIGHT))
+        return size
+
+
+class KaraokeApp(QMainWindow):
+    def __init__(self, room=DEFAULT_ROOM, main_window=None):
         super().__init__()
 
         self.setStyleSheet("""
@@ -156,27 +3175,36 @@ class KaraokeApp(QMainWindow):
             }
         """)
 
-        # Initialize the YouTube Player
-        self.video_server = VideoServer()
-        server_url = self.video_server.start()
-        webbrowser.open(server_url)  # Open the URL of the server in the browser
-
-        self.setWindowTitle("Karaoke Manager")
+        # Every room has its own window with its own song list and displays. The main window starts the server and opens the windows of the other rooms,
+        # which use the same server and are closed together with the main window.
+        self.room = room
+        self.main_window = main_window
+        self.room_windows = []
+        self.room_closed = False
+        if main_window:
+            self.video_server = main_window.video_server
+            self.setWindowTitle(f"Karaoke Manager - {room}")
+        else:
+            # Initialize the YouTube Player
+            self.video_server = VideoServer(SERVER_HOST, stream_mode=STREAM_MODE, server_backend=SERVER_BACKEND, media_cache=create_media_cache() if MEDIA_CACHE else None)
+            self.video_server.start()
+            self.setWindowTitle("Karaoke Manager")
+        self.channel = self.video_server.get_channel(room)
+        webbrowser.open(self.video_server.display_url(room))  # Open the URL of the displays of the room in the browser
         self.resize(800, 600)
 
-        # Define some basic variables
-        self.song_list = []
+        # Define some basic variables. The window only shows the song list, the engine of the room keeps it (also for the REST API of the server).
+        self.songs = []
         self.current_song_data = None
         self.current_song_start_time = None
+        self.countdown_seconds = None  # The seconds until the current song starts, while the countdown is running
         self.edit_mode = False
-        self.countdown_stop_event = threading.Event()  # This variable tells the script to try and stop the countdown
-        self.countdown_thread = threading.Thread()
+        self.displayed_version = None  # The version of the engine which is displayed right now
 
         self.basic_font = "Segoe UI"
-        self.re_pattern = re.compile(r'(https?://)?(www\.)?(youtube\.com)/.+')
 
-        # Load the song_list from the JSON
-        self.load_songs()
+        # Load the song_list from the storage
+        self.engine = QueueEngine(self.channel, create_song_store(STORAGE_BACKEND, room))
 
         # Create the Widgets
         main_widget = QWidget()
@@ -188,99 +3216,104 @@ class KaraokeApp(QMainWindow):
         # Top control buttons
         top_layout = QHBoxLayout()
         self.play_button = QPushButton("Play Next Song")
-        self.play_button.clicked.connect(self.play_next_song)
+        self.play_button.clicked.connect(self.play_button_action)
         top_layout.addWidget(self.play_button)
 
         self.add_button = QPushButton("Add New Song")
         self.add_button.clicked.connect(self.add_song)
         top_layout.addWidget(self.add_button)
 
+        self.import_button = QPushButton("Import Songs")
+        self.import_button.clicked.connect(self.import_songs)
+        top_layout.addWidget(self.import_button)
+
         self.edit_button = QPushButton("Edit Songs")
         self.edit_button.setCheckable(True)
         self.edit_button.clicked.connect(self.toggle_edit_mode)
         top_layout.addWidget(self.edit_button)
 
+        self.auto_advance_button = QPushButton("Auto Advance")
+        self.auto_advance_button.setCheckable(True)
+        self.auto_advance_button.clicked.connect(self.toggle_auto_advance)
+        top_layout.addWidget(self.auto_advance_button)
+
         main_layout.addLayout(top_layout)
 
         self.current_song_label = QLabel("")
         main_layout.addWidget(self.current_song_label)
 
-        # Scrollable song list
-        self.song_list_container = QWidget()
-        self.song_list_layout = QVBoxLayout()
-        self.song_list_container.setLayout(self.song_list_layout)
-
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setWidget(self.song_list_container)
-        main_layout.addWidget(scroll)
-
-        self.song_widgets = []
-        # Create all widgets for all songs
+        self.player_state_label = QLabel("")
+        self.player_state_label.setStyleSheet("color: gray;")
+        main_layout.addWidget(self.player_state_label)
+
+        self.request_url_label = QLabel(describe_request_url(self.video_server, room))
+        self.request_url_label.setStyleSheet("color: gray;")
+        self.request_url_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)  # So the address can be copied
+        main_layout.addWidget(self.request_url_label)
+
+        # Song list. The view only draws the visible rows, which all have the same height.
+        self.song_model = SongListModel()
+        self.song_delegate = SongItemDelegate(self.song_model)
+        self.song_delegate.button_clicked.connect(self.song_button_clicked, Qt.ConnectionType.QueuedConnection)  # Queued, so dialogs aren't opened inside the click event
+
+        self.song_list_view = QListView()
+        self.song_list_view.setModel(self.song_model)
+        self.song_list_view.setItemDelegate(self.song_delegate)
+        self.song_list_view.setUniformItemSizes(True)
+        self.song_list_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.song_list_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        main_layout.addWidget(self.song_list_view)
+
+        # Show all songs
+
+        self.refresh()
+
+        # Check the engine for changes regularly
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.check_engine)
+        self.refresh_timer.start(PLAYER_REPORT_INTERVAL_MS)
+
+        # The windows of the other rooms
+        if main_window is None:
+            for other_room in ROOMS:
+                if other_room != room:
+                    room_window = KaraokeApp(other_room, self)
+                    room_window.show()
+                    self.room_windows.append(room_window)
+
+    def refresh(self):
+        # Copy the state of the engine while it is locked, so it doesn't change in between, and show it without keeping the engine locked
+        with self.engine.lock:
+            self.displayed_version = self.engine.version
+            self.songs = list(self.engine.song_list)
+            self.current_song_data = self.engine.current_song
+            self.current_song_start_time = self.engine.current_song_start_time
+            self.countdown_seconds = self.engine.countdown_seconds if self.engine.countdown_running else None
+            report = self.engine.player_state
+            auto_advance = self.engine.auto_advance
 
         self.update_song_list()
+        self.update_current_song_label()
+        self.player_state_label.setText(describe_player_state(report) if report else "")
+        self.player_state_label.setStyleSheet("color: red;" if report and report["state"] == "error" else "color: gray;")
+        self.play_button.setText("Play Next Song" if self.countdown_seconds is None else "Stop Countdown")
+        self.auto_advance_button.setChecked(auto_advance)
 
-    def load_songs(self):
-        if path.exists(SONG_FILE):
-            with open(SONG_FILE) as file:
-                self.song_list = json.load(file)
-
-    def save_songs(self):
-        with open(SONG_FILE, "w") as file:
-            json.dump(self.song_list, file, indent=4)
+    def check_engine(self):
+        # The countdown, the reports of the displays and the REST API change the engine in other threads, Qt widgets can't be used from them
+        if self.engine.version != self.displayed_version:
+            self.refresh()
 
     def update_song_list(self):
-        # Clear existing widgets
-        for widget in self.song_widgets:
-            widget.deleteLater()
-        self.song_widgets.clear()
-
-        # Remove all existing items (including spacers/stretch) from the layout
-        while self.song_list_layout.count():
-            item = self.song_list_layout.takeAt(0)
-            if item.widget():
-                item.widget().setParent(None)
-            # No need to do anything for spacers here, they are removed by takeAt()
-
-        for index, song_data in enumerate(self.song_list):
-            song_row_widget = QWidget()
-            song_row_layout = QHBoxLayout(song_row_widget)
-            song_row_layout.setContentsMargins(0, 0, 0, 0)
-            song_row_layout.setSpacing(5)
-
-            text = f'Singer: {song_data["person"]} | "{song_data["name"]}" by {song_data["author"]} | Link: {song_data["link"]}'
-            label_color = "green" if song_data == self.current_song_data else "black"
-            label = QLabel(text)
-            label.setStyleSheet(f"color: {label_color}; font-size: 10pt;")
-            song_row_layout.addWidget(label, stretch=1)
-
-            if self.edit_mode:
-                edit_button = QPushButton("Edit")
-                edit_button.clicked.connect(lambda _, i=index: self.edit_song(i))
-                song_row_layout.addWidget(edit_button)
-
-                del_button = QPushButton("Delete")
-                del_button.clicked.connect(lambda _, i=index: self.delete_song(i))
-                song_row_layout.addWidget(del_button)
-
-                up_button = QPushButton("↑")
-                up_button.clicked.connect(lambda _, i=index: self.move_song_up(i))
-                song_row_layout.addWidget(up_button)
-
-                down_button = QPushButton("↓")
-                down_button.clicked.connect(lambda _, i=index: self.move_song_down(i))
-                song_row_layout.addWidget(down_button)
-
-            self.song_list_layout.addWidget(song_row_widget)
-            self.song_widgets.append(song_row_widget)
-
-        # Add vertical stretch (placeholder) to push all content to top, only one stretch at the bottom
-        self.song_list_layout.addStretch(1)
-
-    def is_valid_youtube_link(self, link):
-        return bool(self.re_pattern.match(link))
-
-    def open_song_input_window(self, initial_song_data=None, song_index=None):
+        # The model finds the rows which changed, and the view only repaints the ones which are visible
+        current_song_id = self.current_song_data.id if self.current_song_data else None
+        self.song_model.update_songs(self.songs, current_song_id, self.edit_mode)
+
+    def song_button_clicked(self, text, index):
+        actions = {"Edit": self.edit_song, "Delete": self.delete_song, "↑": lambda row: self.move_song(row, -1), "↓": lambda row: self.move_song(row, 1)}
+        actions[text](index)
+
+    def open_song_input_window(self, initial_song_data=None):
         dialog = QDialog(self)
         dialog.setWindowTitle("Edit Song" if initial_song_data else "Add New Song")  # If there is initial data, it is in edit mode.
         layout = QGridLayout(dialog)
@@ -301,16 +3334,27 @@ class KaraokeApp(QMainWindow):
         link_entry = QLineEdit()
         layout.addWidget(link_entry, 3, 1)
 
+        def browse():
+            # Choose a local video or karaoke file instead of a YouTube link
+            media_files = " ".join("*" + extension for extension in LOCAL_MEDIA_EXTENSIONS)
+            file_path, _ = QFileDialog.getOpenFileName(dialog, "Choose a Media File", "", f"Media files ({media_files});;All files (*)")
+            if file_path:
+                link_entry.setText(file_path)
+
+        browse_btn = QPushButton("Browse...")
+        browse_btn.clicked.connect(browse)
+        layout.addWidget(browse_btn, 3, 2)
+
         error_label = QLabel("")
         error_label.setStyleSheet("color: red;")
-        layout.addWidget(error_label, 4, 0, 1, 2)
+        layout.addWidget(error_label, 4, 0, 1, 3)
 
         # If data already exists use this data.
         if initial_song_data:
-            person_entry.setText(initial_song_data["person"])
-            name_entry.setText(initial_song_data["name"])
-            author_entry.setText(initial_song_data["author"])
-            link_entry.setText(initial_song_data["link"])
+            person_entry.setText(initial_song_data.person)
+            name_entry.setText(initial_song_data.name)
+            author_entry.setText(initial_song_data.author)
+            link_entry.setText(initial_song_data.link)
 
         def save():
             # Get the data of all the entries
@@ -319,30 +3363,26 @@ class KaraokeApp(QMainWindow):
             author = author_entry.text()
             link = link_entry.text()
 
-            # Check for a valid link, if wrong show an error
-            if not self.is_valid_youtube_link(link):
-                error_label.setText("Invalid YouTube link. Please correct it.")
+            # If it is in edit mode (there is initial data) the song keeps its id, so it stays the same song. The engine checks the link, if wrong show an error.
+            try:
+                if initial_song_data:
+                    self.engine.edit_song(initial_song_data.id, person, name, author, link)
+                else:
+                    self.engine.add_song(person, name, author, link)
+            except ValueError:
+                error_label.setText("Invalid YouTube link or media file. Please correct it.")
+                return
+            except KeyError:
+                error_label.setText("The song has been deleted in the meantime.")
                 return
 
-            new_song_data = {"person": person, "name": name, "author": author, "link": link}
-            # If it is in edit mode (there is initial data) modify the data at the known index and modify the label and the current song if needed
-            if initial_song_data:
-                if initial_song_data == self.current_song_data:
-                    self.current_song_data = new_song_data
-                    self.update_current_song_label()
-
-                self.song_list[song_index] = new_song_data
-            else:
-                self.song_list.append(new_song_data)
-
-            # Save the song list and modify the displayed list
-            self.save_songs()
-            self.update_song_list()
+            # Show the changed list
+            self.refresh()
             dialog.accept()
 
         save_btn = QPushButton("Save")
         save_btn.clicked.connect(save)
-        layout.addWidget(save_btn, 5, 0, 1, 2)
+        layout.addWidget(save_btn, 5, 0, 1, 3)
 
         dialog.exec()
 
@@ -355,95 +3395,144 @@ class KaraokeApp(QMainWindow):
         # Create a new song
         self.open_song_input_window()
 
+    def import_songs(self):
+        # Add all the songs of a CSV, JSON or text file at once
+        file_path, _ = QFileDialog.getOpenFileName(self, "Import Songs", "", "Song lists (*.csv *.json *.jsonl *.txt);;All files (*)")
+        if not file_path:
+            return
+
+        try:
+            songs, skipped = self.engine.import_songs(read_song_file(file_path))
+        except (OSError, ValueError, csv.Error) as error:
+            QMessageBox.critical(self, "Import Songs", f"The file could not be read:\n{error}")
+            return
+
+        # The songs are saved and displayed once for the whole file
+        if songs:
+            self.edit_mode = False
+            self.edit_button.setChecked(False)
+            self.refresh()
+        QMessageBox.information(self, "Import Songs", f"{len(songs)} songs were added.\n{skipped} lines were skipped (invalid link or already in the list).")
+
     def toggle_edit_mode(self):
         # This activates/deactivates the edit mode and changes the state of the button
         self.edit_mode = self.edit_button.isChecked()
         self.update_song_list()
 
     def edit_song(self, index):
-        self.open_song_input_window(initial_song_data=self.song_list[index], song_index=index)
+        self.open_song_input_window(initial_song_data=self.songs[index])
 
     def delete_song(self, index):
         # Ask for confirmation
+        song = self.songs[index]
         reply = QMessageBox.question(self, "Confirm Delete",
-                                     f'Are you sure you want to delete "{self.song_list[index]["name"]}", sung by "{self.song_list[index]["person"]}"?',
+                                     f'Are you sure you want to delete "{song.name}", sung by "{song.person}"?',
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            del self.song_list[index]
-            self.save_songs()
-            self.update_song_list()
-
-    # Move the song up or down the list
-    def move_song_up(self, index):
-        if index > 0:
-            self.song_list[index], self.song_list[index - 1] = self.song_list[index - 1], self.song_list[index]
-            self.save_songs()
-            self.update_song_list()
-
-    def move_song_down(self, index):
-        if index < len(self.song_list) - 1:
-            self.song_list[index], self.song_list[index + 1] = self.song_list[index + 1], self.song_list[index]
-            self.save_songs()
-            self.update_song_list()
-
-    def get_current_song_index(self):
-        # Find the index of the actual song, or otherwise return None
-        for index, song in enumerate(self.song_list):
-            if song == self.current_song_data:
-                return index
-        return None
+            try:
+                self.engine.delete_song(song.id)
+            except KeyError:
+                pass  # It has been deleted in the meantime
+            self.refresh()
+
+    def move_song(self, index, offset):
+        # Move the song up or down the list. The position is taken from the engine, the list might have changed since it was displayed.
+        song_id = self.songs[index].id
+        with self.engine.lock:
+            position = self.engine.song_list.index_of(song_id)
+            if position is not None and position + offset >= 0:
+                self.engine.move_song(song_id, position + offset)
+        self.refresh()
 
     def update_current_song_label(self):
         if self.current_song_data:
+            if self.countdown_seconds is not None:
+                status = f"Starting in {self.countdown_seconds} seconds."
+            elif self.current_song_start_time:
+                status = f"Started at: {self.current_song_start_time}"
+            else:
+                status = "The countdown was stopped."
             self.current_song_label.setText(
-                f'Now Playing: "{self.current_song_data["name"]}" by "{self.current_song_data["author"]}" (Singer: {self.current_song_data["person"]}) \nStarted at: {self.current_song_start_time}'
+                f'Now Playing: "{self.current_song_data.name}" by "{self.current_song_data.author}" (Singer: {self.current_song_data.person}) \n{status}'
             )
 
+    def play_button_action(self):
+        # The button stops the countdown while a song is about to start, otherwise it plays the next song
+        if self.engine.countdown_running:
+            self.engine.stop_countdown()
+            self.refresh()
+        else:
+            self.play_next_song()
+
+    def toggle_auto_advance(self):
+        # This activates/deactivates the automatic start of the next song, the engine starts it when the displays report the end of the video
+        self.engine.set_auto_advance(self.auto_advance_button.isChecked())
+
     def play_next_song(self):
         # When the list is empty, show an information message
-        if not self.song_list:
+        if not self.engine.song_list:
             QMessageBox.information(self, "Info", "No songs in the list.")
             return
 
+        # If a song is currently being played, ask whether the song should be removed from the list or just appended at the end of the list
+        remove = False
+        expected_current_id = None
+        current_song = self.engine.current_song
+        if current_song and self.engine.current_song_in_list():
+            reply = QMessageBox.question(self, "Remove Song",
+                                         f'Remove current song "{current_song.name}"?',
+                                         QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            remove = reply == QMessageBox.StandardButton.Yes
+            expected_current_id = current_song.id  # The answer is only for this song
+
         # Disable the edit mode incase it is active
         self.edit_mode = False
         self.edit_button.setChecked(False)
 
-        # If a song is currently being played, get its index and ask whether the song should be removed from the list or just appended at the end of the list
-        if self.current_song_data is not None:
-            current_index = self.get_current_song_index()
-            if current_index is not None:
-                remove = QMessageBox.question(self, "Remove Song",
-                                              f'Remove current song "{self.current_song_data["name"]}"?',
-                                              QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-                if remove == QMessageBox.StandardButton.Yes:
-                    del self.song_list[current_index]
-                else:
-                    self.song_list.append(self.song_list.pop(current_index))
-
-        # If there are any songs in the list set the current song to the newest one, send the song to the server and set the label text
-        if self.song_list:
-            self.current_song_data = self.song_list[0]
-            self.video_server.set_video(self.current_song_data['link'])
-
-            self.current_song_start_time = datetime.now().strftime('%H:%M:%S')
-            self.update_current_song_label()
-
-        self.save_songs()
-        self.update_song_list()
+        self.engine.next_song(remove, expected_current_id)
+        self.refresh()
 
     def closeEvent(self, event):
-        reply = QMessageBox.question(self, "Quit", "Do you really want to quit? \n(This will also stop the webserver)",
+        # The window of another room only closes this room, the server keeps running for the other rooms
+        if self.room_closed:
+            event.accept()
+            return
+        if self.main_window:
+            reply = QMessageBox.question(self, "Close Room", f'Do you really want to close the room "{self.room}"?',
+                                         QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            if reply == QMessageBox.StandardButton.Yes:
+                self.main_window.room_windows.remove(self)
+                self.close_room()
+                event.accept()
+            else:
+                event.ignore()
+            return
+
+        reply = QMessageBox.question(self, "Quit", "Do you really want to quit? \n(This will also stop the webserver and close all rooms)",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            event.accept()
-            sys.exit()
+            for room_window in self.room_windows:
+                room_window.close_room()
+                room_window.close()
+            self.close_room()
+            self.video_server.stop()
+            event.accept()  # Closing the last window ends the event loop and the script
         else:
             event.ignore()
 
+    def close_room(self):
+        # Stop the timer of the window and the engine, which also writes the last changes of the songs
+        self.refresh_timer.stop()
+        self.engine.close()
+        self.room_closed = True
+
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = KaraokeApp()
-    window.show()
-    sys.exit(app.exec())
+    # "python main_pyqt6.py --headless" runs only the server and the song lists, which are then controlled with the REST API
+    if "--headless" in sys.argv:
+        run_headless()
+    else:
+        app = QApplication(sys.argv)
+        window = KaraokeApp()
+        window.show()
+        sys.exit(app.exec())